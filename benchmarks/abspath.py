@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# Compare the construction time and memory of the paths built for each job
+# by submit with the current AbsPath and with the previous implementation,
+# which stored the components of every path in its instance dictionary
+
+import os
+import sys
+import json
+import time
+import platform
+import tracemalloc
+from argparse import ArgumentParser
+
+rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# File keys of the Gaussian progspec
+inputkeys = ['com', 'gjf', 'chk']
+outputkeys = ['log', 'chk', 'wfn', 'cub']
+
+def legacy_class(pathsplit):
+# AbsPath before the components were computed on access
+    class LegacyAbsPath(str):
+        def __new__(cls, path='/', parent=None):
+            if parent is not None and not os.path.isabs(path):
+                path = os.path.join(parent, path)
+            elif not os.path.isabs(path):
+                raise ValueError('Path must be absolute')
+            obj = str.__new__(cls, path)
+            obj.parts = pathsplit(obj)
+            obj.name = os.path.basename(obj)
+            obj.stem, obj.suffix = os.path.splitext(obj.name)
+            return obj
+        def __mul__(self, right):
+            return LegacyAbsPath(self.name + '.' + right, parent=self.parent())
+        def __truediv__(self, right):
+            return LegacyAbsPath(right, parent=self)
+        def parent(self):
+            return LegacyAbsPath(os.path.dirname(self))
+    return LegacyAbsPath
+
+def job(pathclass, campaigndir, scratchdir, index):
+# The paths built by submit for one input file
+    jobname = f'job{index:06d}'
+    workdir = pathclass(campaigndir)
+    outdir = workdir/jobname
+    stagedir = outdir
+    jobdir = stagedir/'.job'
+    execdir = pathclass(scratchdir)/str(index)
+    paths = [outdir, jobdir, execdir, jobdir/'script', jobdir/'id']
+    for key in inputkeys:
+        source = workdir/jobname*key
+        paths.extend((source, source.parent(), stagedir/jobname*key, execdir/f'job.{key}'))
+    for key in outputkeys:
+        paths.extend((execdir/f'job.{key}', outdir/jobname*key))
+    return paths
+
+def measure(pathclass, count, repeat):
+    campaigndir = '/home/user/campaigns/benchmark'
+    scratchdir = '/scratch/user'
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(count):
+            job(pathclass, campaigndir, scratchdir, i)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    # Memory retained by the paths of all the jobs kept alive at once
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    retained = [job(pathclass, campaigndir, scratchdir, i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    paths = sum(len(i) for i in retained)
+    return dict(
+        us_per_job = 1e6*best/count,
+        bytes_per_job = (after - before)/count,
+        paths_per_job = paths/count,
+    )
+
+def main():
+    parser = ArgumentParser(description='Mide el costo de construir las rutas de cada trabajo con AbsPath.')
+    parser.add_argument('-n', '--count', type=int, metavar='N', default=10000, help='Número de trabajos simulados.')
+    parser.add_argument('-r', '--repeat', type=int, metavar='N', default=5, help='Repeticiones de la medición de tiempo.')
+    parser.add_argument('-o', '--output', metavar='FILE', default=None, help='Escribir los resultados en el archivo FILE.')
+    args = parser.parse_args()
+
+    sys.path.insert(0, rootdir)
+    from clusterq.fileutils import AbsPath, pathsplit
+
+    results = {}
+    for label, pathclass in (('legacy', legacy_class(pathsplit)), ('current', AbsPath)):
+        results[label] = measure(pathclass, args.count, args.repeat)
+        print(f"{label:>8} {results[label]['us_per_job']:>8.1f} us/job {results[label]['bytes_per_job']:>8.0f} bytes/job")
+
+    print(f"{'ratio':>8} {results['legacy']['us_per_job']/results['current']['us_per_job']:>8.2f}x        {results['legacy']['bytes_per_job']/results['current']['bytes_per_job']:>8.2f}x")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(
+                python = platform.python_version(),
+                platform = platform.platform(),
+                date = time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                jobs = args.count,
+                results = results,
+            ), f, indent=2)
+
+if __name__ == '__main__':
+    main()
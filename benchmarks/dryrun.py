@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# Measure the overhead of clusterq itself by submitting synthetic campaigns
+# with --dry-run and writing the results to a JSON file
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import tempfile
+from argparse import ArgumentParser
+from configparser import ConfigParser
+from subprocess import run, DEVNULL
+
+rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+packagedir = os.path.join(rootdir, 'clusterq')
+fixturedir = os.path.join(rootdir, 'tests')
+
+programs = {
+    'gaussian': dict(progspecfile='gaussian.json5', executable='g16'),
+    'orca': dict(progspecfile='orca.json5', executable='/opt/orca/orca', mpilib='openmpi'),
+    'vasp': dict(progspecfile='vasp.json5', executable='vasp_std', mpilib='openmpi'),
+    'dftbplus': dict(progspecfile='dftbplus.json5', executable='dftb+'),
+    'demon2k': dict(progspecfile='demon2k.json5', executable='deMon', mpilib='openmpi'),
+}
+
+# Operations without audit events that are counted by wrapping the os module
+wrapped = ('stat', 'lstat', 'access')
+
+def audited(event):
+    return event == 'open' or event.startswith(('os.', 'shutil.', 'subprocess.'))
+
+def readspec(path):
+    import pyjson5
+    with open(path, 'r') as f:
+        return pyjson5.load(f)
+
+def clusterq_version():
+    parser = ConfigParser()
+    parser.read(os.path.join(rootdir, 'setup.cfg'))
+    return parser.get('metadata', 'version', fallback=None)
+
+def write_config(cfgdir, queuespecfile):
+    os.makedirs(os.path.join(cfgdir, 'profiles'))
+    shutil.copytree(os.path.join(packagedir, 'progspecs'), os.path.join(cfgdir, 'progspecs'))
+    shutil.copytree(os.path.join(packagedir, 'queuespecs'), os.path.join(cfgdir, 'queuespecs'))
+    with open(os.path.join(cfgdir, 'profiles', '__cluster__.json5'), 'w') as f:
+        json.dump(dict(
+            clustername = 'benchmark',
+            queuespecfile = queuespecfile,
+            filesync = 'local',
+            logdir = os.path.join(cfgdir, 'logs'),
+            delay = '0',
+            defaults = dict(scratch=os.path.join(cfgdir, 'scratch')),
+        ), f, indent=3)
+    for program, profile in programs.items():
+        profile = dict(profile)
+        executable = profile.pop('executable')
+        profile.update(
+            progname = program,
+            displayname = program,
+            versions = {'bench': {'executable': executable}},
+            defaults = {'version': 'bench'},
+        )
+        with open(os.path.join(cfgdir, 'profiles', program + '.json5'), 'w') as f:
+            json.dump(profile, f, indent=3)
+
+def fixture_groups(program):
+# Group the fixture files of a program by input name, skipping inputs
+# that would need interpolation variables to be processed
+    sys.path.insert(0, rootdir)
+    from clusterq.utils import InterpolationTemplate, CompiledTemplate
+    spec = readspec(os.path.join(packagedir, 'progspecs', programs[program]['progspecfile']))
+    keys = sorted(spec['inputfiles'], key=len, reverse=True)
+    groups = {}
+    for filename in sorted(os.listdir(os.path.join(fixturedir, program))):
+        for key in keys:
+            if filename.endswith('.' + key):
+                groups.setdefault(filename[:-len(key)-1], {})[key] = os.path.join(fixturedir, program, filename)
+                break
+    usable = []
+    for name, files in groups.items():
+        for key, path in files.items():
+            if key in spec.get('interpolable', []):
+                with open(path, 'r') as f:
+                    if CompiledTemplate(InterpolationTemplate, f.read()).keys:
+                        break
+        else:
+            mainkey = next(key for key in spec['inputfiles'] if key in files)
+            usable.append((mainkey, files))
+    return usable
+
+def generate(campaigndir, groups, size):
+    arguments = []
+    os.makedirs(campaigndir)
+    for i in range(size):
+        mainkey, files = groups[i % len(groups)]
+        name = f'job{i:06d}'
+        for key, path in files.items():
+            shutil.copyfile(path, os.path.join(campaigndir, f'{name}.{key}'))
+        arguments.append(f'{name}.{mainkey}')
+    return arguments
+
+def child(resultfile, command, cwd, listfile):
+# Run clusterq in this process counting the file system operations of each phase
+    counts = {}
+    phase = ['import']
+    current = lambda: None
+    def count(event, args=None):
+        phasecounts = counts.setdefault(current() or phase[0], {})
+        phasecounts[event] = phasecounts.get(event, 0) + 1
+    def hook(event, args):
+        if audited(event):
+            count(event)
+    def wrap(name, function):
+        def wrapper(*args, **kwargs):
+            count('os.' + name)
+            return function(*args, **kwargs)
+        return wrapper
+    for name in wrapped:
+        setattr(os, name, wrap(name, getattr(os, name)))
+    sys.addaudithook(hook)
+    with open(listfile, 'r') as f:
+        files = f.read().splitlines()
+    timings = {}
+    start = time.perf_counter()
+    sys.path.insert(0, rootdir)
+    from clusterq import main, tracing
+    timings['import'] = time.perf_counter() - start
+    current = tracing.current
+    phase[0] = 'run'
+    sys.argv = [sys.argv[0], command, '--dry-run', '--yes', '--cwd', cwd] + files
+    start = time.perf_counter()
+    try:
+        main.run()
+    except SystemExit as e:
+        if e.code:
+            raise
+    timings['run'] = time.perf_counter() - start
+    phase[0] = 'report'
+    current = lambda: None
+    for name, (calls, seconds, maximum) in tracing.summary.items():
+        timings[name] = seconds
+    with open(resultfile, 'w') as f:
+        json.dump(dict(
+            timings = timings,
+            counts = counts,
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        ), f)
+
+def benchmark(cfgdir, workdir, program, size, keep):
+    groups = fixture_groups(program)
+    if not groups:
+        raise SystemExit(f'No hay archivos de prueba utilizables para {program}')
+    campaigndir = os.path.join(workdir, f'{program}-{size}')
+    start = time.perf_counter()
+    arguments = generate(campaigndir, groups, size)
+    generation = time.perf_counter() - start
+    listfile = campaigndir + '.args'
+    resultfile = campaigndir + '.json'
+    logfile = campaigndir + '.log'
+    with open(listfile, 'w') as f:
+        f.write('\n'.join(arguments) + '\n')
+    env = dict(os.environ, CLUSTERQCFG=cfgdir, HOME=workdir)
+    with open(logfile, 'w') as log:
+        process = run([sys.executable, os.path.abspath(__file__), '--child', resultfile, program, campaigndir, listfile], env=env, stdin=DEVNULL, stdout=log, stderr=log)
+    if process.returncode != 0:
+        with open(logfile, 'r') as log:
+            raise SystemExit(f'Falló la prueba {program}-{size}:\n' + log.read()[-2000:])
+    with open(resultfile, 'r') as f:
+        result = json.load(f)
+    if not keep:
+        shutil.rmtree(campaigndir)
+    phases = {'generate': dict(seconds=generation)}
+    for phase, seconds in result['timings'].items():
+        phases[phase] = dict(seconds=seconds, operations=result['counts'].get(phase, {}))
+    return dict(
+        program = program,
+        inputs = size,
+        jobs_per_second = size/result['timings']['run'],
+        maxrss_kb = result['maxrss'],
+        phases = phases,
+    )
+
+def main():
+    parser = ArgumentParser(description='Mide el rendimiento de clusterq procesando campañas sintéticas con --dry-run.')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', metavar='N', default=[1000, 10000, 100000], help='Número de archivos de entrada de cada campaña.')
+    parser.add_argument('-p', '--programs', nargs='+', metavar='PROGRAM', choices=programs, default=list(programs), help='Programas a evaluar.')
+    parser.add_argument('-q', '--queuespec', metavar='FILE', default='slurm.json5', help='Especificación del gestor de trabajos.')
+    parser.add_argument('-o', '--output', metavar='FILE', default='dryrun.json', help='Escribir los resultados en el archivo FILE.')
+    parser.add_argument('-w', '--workdir', metavar='PATH', default=None, help='Generar las campañas en el directorio PATH.')
+    parser.add_argument('-k', '--keep', action='store_true', help='No eliminar las campañas generadas.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='clusterq-bench-', dir=args.workdir)
+    cfgdir = os.path.join(workdir, 'config')
+    write_config(cfgdir, args.queuespec)
+
+    results = []
+    for program in args.programs:
+        for size in args.sizes:
+            result = benchmark(cfgdir, workdir, program, size, args.keep)
+            results.append(result)
+            print(f"{program:>10} {size:>8} {result['jobs_per_second']:>10.1f} jobs/s {result['maxrss_kb']/1024:>8.1f} MiB")
+
+    with open(args.output, 'w') as f:
+        json.dump(dict(
+            clusterq = clusterq_version(),
+            python = platform.python_version(),
+            platform = platform.platform(),
+            date = time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            queuespec = args.queuespec,
+            results = results,
+        ), f, indent=2)
+
+    if not args.keep:
+        shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        child(*sys.argv[2:])
+    else:
+        main()
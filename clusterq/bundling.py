@@ -0,0 +1,52 @@
+import os
+import time
+from clinterface import messages, _
+from .shared import names, options, settings, script, bundle
+from .queue import dispatchjob
+from .fileutils import AbsPath
+from .utils import AttrDict
+from .tracing import span
+
+def addtask(claims, jobname, jobdir, execdir, imports, exports):
+# The claim on the job directory is kept until the bundle is submitted
+    (jobdir/'exit').remove()
+    bundle.append(AttrDict(
+        jobname = jobname,
+        jobdir = jobdir,
+        claims = claims.pop_all(),
+        function = script.skeleton.task(len(bundle) + 1, jobname, execdir, imports, exports, jobdir),
+    ))
+    if len(bundle) >= options.common.bundle:
+        flushbundle()
+
+def flushbundle():
+# Submit the pending tasks as a single job
+    if not bundle:
+        return
+    settings.bundlecount = settings.get('bundlecount', 0) + 1
+    bundlename = f"{names.command}-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{settings.bundlecount}"
+    bundledir = AbsPath(options.common.cwd)/'.bundles'/bundlename
+    try:
+        bundledir.makedirs()
+        jobscript = bundledir/'script'
+        with span('script'), open(jobscript, 'w') as f:
+            f.write(script.skeleton.launcher(bundlename, [task.function for task in bundle]))
+        with open(bundledir/'tasks', 'w') as f:
+            f.write(''.join(f'{i} {task.jobdir}\n' for i, task in enumerate(bundle, start=1)))
+        if options.debug.dry_run:
+            messages.success(_('Se procesó el paquete "$bundle" con $count trabajo(s) y se generaron los archivos para el envío en el directorio $bundledir', bundle=bundlename, count=len(bundle), bundledir=bundledir))
+        else:
+            try:
+                jobid = dispatchjob(jobscript)
+            except RuntimeError as error:
+                messages.failure(_('El gestor de trabajos reportó el siguiente error al enviar el paquete $bundle: $error', bundle=bundlename, error=error))
+            else:
+                messages.success(_('El paquete "$bundle" con $count trabajo(s) se correrá en $nproc núcleo(s) en $clustername con el número $jobid', bundle=bundlename, count=len(bundle), nproc=options.common.nproc, clustername=names.cluster, jobid=jobid))
+                for task in bundle:
+                    with open(task.jobdir/'id', 'w') as f:
+                        f.write(jobid)
+    finally:
+        # Release the job directories only once their job ids are written
+        for task in bundle:
+            task.claims.close()
+        bundle.clear()
@@ -0,0 +1,57 @@
+import os
+from clinterface import messages, _
+from .shared import names, nodes, paths, config
+from .utils import readspec
+from .fileutils import AbsPath
+from .tracing import span
+
+def loadconfig(cfgdir, command=None):
+# Merge the cluster profile, the program profile and the user profiles
+# into config, without the program profile if command is None
+
+    if cfgdir is None:
+        messages.error(_('No se especificó el directorio de configuración'), 'CLUSTERQCFG')
+
+    paths.cfgdir = AbsPath(cfgdir, parent=os.getcwd())
+    userconfdir = paths.home/'.clusterq'
+
+    with span('config'):
+
+        config.merge(readspec(paths.cfgdir/'profiles'/'__cluster__.json5'))
+        if command is not None:
+            config.merge(readspec(paths.cfgdir/'profiles'/command*'json5'))
+            config.merge(readspec(paths.cfgdir/'progspecs'/config.progspecfile))
+        config.merge(readspec(paths.cfgdir/'queuespecs'/config.queuespecfile))
+
+        try:
+            config.merge(readspec(userconfdir/'__cluster__.json5'))
+        except FileNotFoundError:
+            pass
+
+        if command is not None:
+            try:
+                config.merge(readspec(userconfdir/command*'json5'))
+            except FileNotFoundError:
+                pass
+
+    if command is not None:
+
+        try:
+            config.progname
+        except AttributeError:
+            messages.error(_('No se definió el nombre del programa'))
+
+        try:
+            config.displayname
+        except AttributeError:
+            messages.error(_('No se definió el nombre del programa para mostrar'))
+
+    try:
+        names.cluster = config.clustername
+    except AttributeError:
+        messages.error(_('No se definió el nombre del clúster'))
+
+    try:
+        nodes.head = config.headnode
+    except AttributeError:
+        nodes.head = names.host
@@ -8,6 +8,15 @@ from clinterface import messages, prompts, _
 from subprocess import check_output, DEVNULL
 from .utils import readspec, shq
 from .fileutils import AbsPath
+from .pilot import clusterq_pilot
+from .report import clusterq_report
+from .tail import clusterq_tail
+from .retry import clusterq_retry
+from .monitor import clusterq_status
+from .queue import canceljob
+from .configuration import loadconfig
+from .paramindex import buildindex, saveindex, indexfile
+from .shared import paths, paramindex
 
 selector = prompts.Selector()
 completer = prompts.Completer()
@@ -18,10 +27,24 @@ def clusterq():
 
     parser = ArgumentParser(description='Herramienta de configuración de ClusterQ.')
     parser.add_argument('command', metavar='command')
-    args = parser.parse_args()
+    args, arglist = parser.parse_known_args()
 
     if args.command == 'setup':
         clusterq_setup()
+    elif args.command == 'pilot':
+        clusterq_pilot(arglist)
+    elif args.command == 'cancel':
+        clusterq_cancel(arglist)
+    elif args.command == 'report':
+        clusterq_report(arglist)
+    elif args.command == 'tail':
+        clusterq_tail(arglist)
+    elif args.command == 'index':
+        clusterq_index(arglist)
+    elif args.command == 'retry':
+        clusterq_retry(arglist)
+    elif args.command == 'status':
+        clusterq_status(arglist)
     else:
         messages.error(_('$command no es un comando válido', command=args.command))
 
@@ -108,3 +131,56 @@ def clusterq_setup():
                 file.write('#!/bin/sh\n')
                 file.write(' '.join(command) + '\n')
             (bindir/package).chmod(0o755)
+
+
+def clusterq_cancel(arglist):
+
+    parser = ArgumentParser(prog='clusterq cancel', description='Cancela los trabajos cuyos archivos de salida se escriben en los directorios especificados.')
+    parser.add_argument('dirs', nargs='+', metavar='PATH', help='Directorios de salida de los trabajos.')
+    parser.add_argument('--cfgdir', metavar='PATH', default=os.environ.get('CLUSTERQCFG'), help='Usar la configuración del directorio PATH.')
+    args = parser.parse_args(arglist)
+
+    loadconfig(args.cfgdir)
+
+    for path in args.dirs:
+        outdir = AbsPath(path, parent=os.getcwd())
+        try:
+            with open(outdir/'.job'/'id', 'r') as f:
+                jobid = f.read()
+        except FileNotFoundError:
+            messages.failure(_('No se envió ningún trabajo desde el directorio $path', path=outdir))
+            continue
+        try:
+            canceljob(jobid)
+        except RuntimeError as error:
+            messages.failure(_('El gestor de trabajos reportó el siguiente error al cancelar el trabajo $jobid: $error', jobid=jobid, error=error))
+        else:
+            messages.success(_('Se canceló el trabajo $jobid', jobid=jobid))
+
+
+def clusterq_index(arglist):
+
+    parser = ArgumentParser(prog='clusterq index', description='Actualiza el índice de los directorios de conjuntos de parámetros.')
+    parser.add_argument('programs', nargs='*', metavar='PROGRAM', help='Indexar sólo los parámetros de estos programas.')
+    parser.add_argument('--rebuild', action='store_true', help='Listar de nuevo todos los directorios aunque no hayan cambiado.')
+    parser.add_argument('--cfgdir', metavar='PATH', default=os.environ.get('CLUSTERQCFG'), help='Usar la configuración del directorio PATH.')
+    args = parser.parse_args(arglist)
+
+    loadconfig(args.cfgdir)
+
+    parameterpaths = []
+    for spec in (paths.cfgdir/'profiles').listdir():
+        name, ext = os.path.splitext(spec)
+        if ext != '.json5' or name == '__cluster__' or args.programs and name not in args.programs:
+            continue
+        specdict = readspec(paths.cfgdir/'profiles'/spec)
+        parameterpaths.extend(specdict.get('parameterpaths', []))
+        if 'progspecfile' in specdict:
+            parameterpaths.extend(readspec(paths.cfgdir/'progspecs'/specdict['progspecfile']).get('parameterpaths', []))
+        if (paths.home/'.clusterq'/spec).isfile():
+            parameterpaths.extend(readspec(paths.home/'.clusterq'/spec).get('parameterpaths', []))
+
+    buildindex(parameterpaths, args.rebuild)
+    saveindex()
+    messages.success(_('Se indexaron $count directorios en $path', count=len(paramindex.listings), path=indexfile()))
+
@@ -2,6 +2,7 @@ import os
 import string
 import shutil
 import fnmatch
+from functools import lru_cache
 from clinterface import messages, _
 
 def file_except_info(exception, path):
@@ -32,6 +33,9 @@ class NotAbsolutePath(Exception):
     pass
 
 class AbsPath(str):
+# The components are computed on access instead of being stored, so that
+# paths take the same memory as plain strings
+    __slots__ = ()
     def __new__(cls, path='/', parent=None):
         if not isinstance(path, str):
             raise TypeError('Path must be a string')
@@ -46,26 +50,41 @@ class AbsPath(str):
             if not os.path.isabs(parent):
                 raise ValueError('Parent directory must be an absolute path')
             path = os.path.join(parent, path)
+        if emptycomponents(path):
+            raise Exception('Path has empty components')
 #        obj = str.__new__(cls, os.path.normpath(path))
-        obj = str.__new__(cls, path)
-        obj.parts = pathsplit(obj)
-        obj.name = os.path.basename(obj)
-        obj.stem, obj.suffix = os.path.splitext(obj.name)
-        return obj
+        return str.__new__(cls, path)
+    @property
+    def parts(self):
+        return pathsplit(self)
+    @property
+    def name(self):
+        return self.rpartition(os.path.sep)[2]
+    @property
+    def stem(self):
+        return os.path.splitext(self.name)[0]
+    @property
+    def suffix(self):
+        return os.path.splitext(self.name)[1]
     def __mul__(self, right):
         if not isinstance(right, str):
             raise TypeError('Right operand must be a string')
         if '/' in right:
             raise ValueError('Can not use a path as an extension')
-        return AbsPath(self.name + '.' + right, parent=self.parent())
+        return str.__new__(AbsPath, self + '.' + right)
     def __truediv__(self, right):
         if not isinstance(right, str):
             raise TypeError('Right operand must be a string')
         if isinstance(right, AbsPath):
             raise ValueError('Can not join two absolute paths')
-        return AbsPath(right, parent=self)
+        if not right or os.path.isabs(right) or emptycomponents(right):
+            return AbsPath(right, parent=self)
+        # Both operands are known to be valid
+        if self == os.path.sep:
+            return str.__new__(AbsPath, self + right)
+        return str.__new__(AbsPath, self + os.path.sep + right)
     def parent(self):
-        return AbsPath(os.path.dirname(self))
+        return parentpath(os.path.dirname(self))
     def listdir(self):
         return os.listdir(self)
     def hasext(self, suffix):
@@ -145,3 +164,11 @@ def pathsplit(path):
         return componentlist
     else:
         return []
+
+def emptycomponents(path):
+    return '//' in path or path.endswith(os.path.sep) and path != os.path.sep
+
+@lru_cache(maxsize=1024)
+def parentpath(path):
+# Jobs of the same campaign share their parent directories
+    return AbsPath(path)
@@ -0,0 +1,250 @@
+import re
+import time
+import sqlite3
+import threading
+from hashlib import sha1
+from math import ceil, log
+from clinterface import messages, _
+from .shared import names, paths, config, options, settings, status, script
+from .utils import ConfigTemplate, compiled_template
+from .fileutils import AbsPath
+from .paramindex import contentkey
+
+# Submitted jobs are recorded with the size of their input, and the start
+# and end times, exit status and peak memory written by the job script to
+# .job/stats are harvested into the record once the job has finished.
+
+schema = '''create table if not exists jobs (
+    cluster text not null,
+    jobid text not null,
+    program text,
+    version text,
+    queue text,
+    user text,
+    jobname text,
+    outdir text,
+    nproc integer,
+    inputsize integer,
+    natoms integer,
+    walltime integer,
+    memory integer,
+    submitted real,
+    started real,
+    finished real,
+    exitcode integer,
+    maxrss integer,
+    state text,
+    elapsed real,
+    cputime real,
+    fingerprint text,
+    command text,
+    attempt integer,
+    retryof text,
+    primary key (cluster, jobid)
+)'''
+
+# Columns added after the table was first created
+addedcolumns = {
+    'state': 'text',
+    'elapsed': 'real',
+    'cputime': 'real',
+    'fingerprint': 'text',
+    'command': 'text',
+    'attempt': 'integer',
+    'retryof': 'text',
+}
+
+connections = {}
+
+def database():
+    if 'historydb' in config:
+        path = AbsPath(ConfigTemplate(config.historydb).substitute(names))
+    else:
+        path = paths.home/'.clusterq'/'history.db'
+    # Connections cannot be shared between threads
+    key = (path, threading.get_ident())
+    if key not in connections:
+        path.parent().makedirs()
+        connection = sqlite3.connect(path, timeout=30)
+        connection.execute(schema)
+        columns = [row[1] for row in connection.execute('pragma table_info(jobs)')]
+        for column, type in addedcolumns.items():
+            if column not in columns:
+                connection.execute(f'alter table jobs add column {column} {type}')
+        connection.execute('create index if not exists fingerprints on jobs (cluster, fingerprint)')
+        connections[key] = connection
+    return connections[key]
+
+def parsewalltime(value):
+# Accept minutes or [days-]hours:minutes[:seconds] and return seconds
+    match = re.fullmatch(r'(?:(\d+)-)?(\d+):(\d+)(?::(\d+))?', value)
+    if match:
+        days, hours, minutes, seconds = (int(x or 0) for x in match.groups())
+        return ((days*24 + hours)*60 + minutes)*60 + seconds
+    elif value.isdigit():
+        return int(value)*60
+    else:
+        messages.error(_('El tiempo de ejecución no es válido'), f'walltime={value}')
+
+def parsememory(value):
+# Accept an amount with an optional K, M, G or T suffix and return megabytes
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([KMGT]?)B?', value.upper())
+    if match:
+        return ceil(float(match.group(1))*{'K': 2**-10, '': 1, 'M': 1, 'G': 2**10, 'T': 2**20}[match.group(2)])
+    else:
+        messages.error(_('La cantidad de memoria no es válida'), f'mem={value}')
+
+def parseduration(value):
+# Accept seconds with an optional unit or [days-][hours:]minutes:seconds[.fraction]
+    match = re.fullmatch(r'(?:(\d+)-)?(?:(?:(\d+):)?(\d+):)?(\d+(?:\.\d+)?)(?: ?s(?:econds?(?:\(s\))?)?)?', value.strip())
+    if match is None:
+        return None
+    days, hours, minutes, seconds = match.groups()
+    return ((int(days or 0)*24 + int(hours or 0))*60 + int(minutes or 0))*60 + float(seconds)
+
+def parsesize(value):
+# Accept an amount of memory with an optional unit and return kilobytes
+    match = re.fullmatch(r'(\d+(?:\.\d+)?) ?([KMGT]?)(?:B|BYTES)?', value.strip().upper())
+    if match is None:
+        return None
+    return round(float(match.group(1))*{'': 2**-10, 'K': 1, 'M': 2**10, 'G': 2**20, 'T': 2**30}[match.group(2)])
+
+def recordjob(jobid, jobname, outdir, inputsize, natoms, walltime, memory, fingerprint=None, command=None):
+# Resubmissions by clusterq retry are numbered after the job they retry
+    retryof = options.common.retry_of if 'retry_of' in options.common else None
+    with database() as db:
+        db.execute('insert or replace into jobs (cluster, jobid, program, version, queue, user, jobname, outdir, nproc, inputsize, natoms, walltime, memory, submitted, fingerprint, command, retryof, attempt) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, coalesce((select coalesce(attempt, 1) from jobs where cluster = ? and jobid = ?), 0) + 1)', (
+            names.cluster,
+            jobid,
+            config.progname,
+            settings.version,
+            settings.queue,
+            names.user,
+            jobname,
+            outdir,
+            options.common.nproc,
+            inputsize,
+            natoms,
+            walltime,
+            memory,
+            time.time(),
+            fingerprint,
+            command,
+            retryof,
+            names.cluster,
+            retryof,
+        ))
+
+def harvest():
+# Read the stats of the unfinished jobs of the program which were written
+# after their submission, so that stats of later jobs are not mistaken for them
+    db = database()
+    updates = []
+    for jobid, outdir, submitted in db.execute('select jobid, outdir, submitted from jobs where cluster = ? and program = ? and finished is null', (names.cluster, config.progname)):
+        try:
+            with open(AbsPath(outdir)/'.job'/'stats', 'r') as f:
+                fields = f.read().split()
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        try:
+            started, finished, exitcode = (int(x) for x in fields[:3])
+            maxrss = int(fields[3])//1024 if len(fields) > 3 else None
+        except (ValueError, IndexError):
+            continue
+        if started >= int(submitted):
+            updates.append((started, finished, exitcode, maxrss, names.cluster, jobid))
+    if updates:
+        with db:
+            db.executemany('update jobs set started = ?, finished = ?, exitcode = ?, maxrss = ? where cluster = ? and jobid = ?', updates)
+
+def fingerprint(inputfiles, parameterpaths):
+# Hash of everything that determines the results of a job: the program,
+# version and command line, the contents of the input files after
+# interpolation and the parameter sets
+    digest = sha1()
+    for item in [config.progname, settings.version, ' '.join(script.body)] + list(config.prescript):
+        digest.update(item.encode() + b'\0')
+    for key, path in sorted(inputfiles.items()):
+        digest.update(key.encode() + b'\0')
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(b'\0')
+    for path in parameterpaths:
+        digest.update(contentkey(path).encode() + b'\0')
+    return digest.hexdigest()
+
+def succeeded():
+# Condition on the jobs that finished successfully: exit status 0 and a
+# completed final state once the accounting was harvested, or the stats of
+# the job script before that
+    states = list(config.completed_states)
+    return f"exitcode = 0 and (state in ({','.join('?'*len(states))}) or state is null and finished is not null)", states
+
+def findresult(fingerprint):
+# Output directory and job name of the last successful job with the same
+# fingerprint whose output files are still there
+    if not status.harvested:
+        harvest()
+        status.harvested = True
+    condition, states = succeeded()
+    for outdir, jobname in database().execute(f'select outdir, jobname from jobs where cluster = ? and fingerprint = ? and {condition} order by finished desc', [names.cluster, fingerprint] + states):
+        outdir = AbsPath(outdir)
+        if any((outdir/jobname*key).isfile() for key in config.outputfiles):
+            return outdir, jobname
+    return None
+
+def predict(inputsize, natoms):
+# Walltime and memory of the most similar successful jobs of the same
+# program and version, scaled up when the new job is larger or has fewer
+# cores but never down, and multiplied by the safety margin
+    autosize = config.get('autosize', {})
+    if not status.harvested:
+        harvest()
+        status.harvested = True
+    condition, states = succeeded()
+    rows = database().execute(f'select inputsize, natoms, nproc, coalesce(elapsed, finished - started), maxrss from jobs where cluster = ? and program = ? and version = ? and {condition} and coalesce(elapsed, finished - started) is not null order by submitted desc limit ?', [names.cluster, config.progname, settings.version] + states + [autosize.get('history', 1000)]).fetchall()
+    if len(rows) < autosize.get('minjobs', 3):
+        return None, None
+    def ratio(row):
+        if natoms and row[1]:
+            return natoms/row[1]
+        elif inputsize and row[0]:
+            return inputsize/row[0]
+        else:
+            return 1
+    nearest = sorted(rows, key=lambda row: abs(log(ratio(row))))[:autosize.get('neighbors', 5)]
+    margin = autosize.get('margin', 1.5)
+    walltime = max(row[3]*max(1, ratio(row))*max(1, row[2]/options.common.nproc) for row in nearest)
+    walltime = max(ceil(margin*walltime/60)*60, autosize.get('minwalltime', 600))
+    memories = [row[4]*max(1, ratio(row)) for row in nearest if row[4]]
+    memory = ceil(margin*max(memories)/1024) if memories else None
+    return walltime, memory
+
+def resources(inputsize, natoms):
+# Requested walltime and memory, the options given by the user take
+# precedence over the predictions
+    walltime = settings.walltime
+    memory = settings.memory
+    if options.common.autosize and (walltime is None or memory is None):
+        predicted = predict(inputsize, natoms)
+        if walltime is None:
+            walltime = predicted[0]
+        if memory is None:
+            memory = predicted[1]
+    return walltime, memory
+
+def directives(walltime, memory):
+    meta = []
+    if walltime is not None:
+        if not 'walltime' in config:
+            messages.error(_('El gestor de trabajos no admite solicitar el tiempo de ejecución'), 'config.walltime')
+        meta.append(compiled_template(ConfigTemplate, config.walltime).substitute(
+            walltime = f'{walltime//3600}:{walltime//60%60:02d}:{walltime%60:02d}',
+            wallminutes = ceil(walltime/60),
+        ))
+    if memory is not None:
+        if not 'memory' in config:
+            messages.error(_('El gestor de trabajos no admite solicitar la memoria'), 'config.memory')
+        meta.append(compiled_template(ConfigTemplate, config.memory).substitute(memory=memory))
+    return meta
@@ -1,4 +1,5 @@
-import sys
+import os, sys
+from math import ceil
 #from tkdialogs import messages, prompts
 from clinterface import messages, prompts, _
 from subprocess import CalledProcessError, check_output
@@ -6,25 +7,62 @@ from .shared import booleans, names, nodes, paths, config, options, settings, st
 from .utils import GlobDict, LogDict, ConfigTemplate, FilterGroupTemplate, InterpolationTemplate, template_parse, natural_sorted as sorted
 from .fileutils import AbsPath, NotAbsolutePath
 from .readmol import readmol, molblock
+from .tracing import traced
+from .jobscript import Skeleton, nodecache, stallstates
+from .queue import selectqueue
+from .history import parsewalltime, parsememory
+from .paramindex import assertparamdir, globparams
 
 selector = prompts.Selector()
 completer = prompts.Completer()
 completer.set_truthy_options(['si', 'yes'])
 completer.set_falsy_options(['no'])
 
+def findrestartfiles(joblist):
+# Restart files are taken from the output directory of a previous job or
+# given explicitly, and are resolved to their real path so that restarts
+# of restarts still point to the original files
+    restartfiles = {}
+    if joblist and not config.restartfiles:
+        messages.error(_('$program no admite archivos de reinicio', program=config.displayname))
+    for key, outkey in config.restartfiles.items():
+        if not key in config.inputfiles:
+            messages.error(_('Elemento no encontrado'), f'{key} in config.restartfiles but not in config.inputfiles')
+        if not outkey in config.outputfiles:
+            messages.error(_('Elemento no encontrado'), f'{outkey} in config.restartfiles but not in config.outputfiles')
+    for job in joblist:
+        path = AbsPath(job, parent=options.common.cwd)
+        found = {}
+        if path.isdir():
+            for key, outkey in config.restartfiles.items():
+                if (path/path.name*outkey).isfile():
+                    found[key] = path/path.name*outkey
+        elif path.isfile():
+            for key, outkey in config.restartfiles.items():
+                if path.name.endswith('.' + outkey):
+                    found[key] = path
+        else:
+            messages.error(_('El trabajo o archivo de reinicio $path no existe', path=path))
+        if not found:
+            messages.error(_('No se encontraron archivos de reinicio de $program en $path', program=config.progname, path=path))
+        for key, source in found.items():
+            if key in restartfiles:
+                messages.error(_('Se especificó más de un archivo de reinicio del tipo $key', key=key))
+            restartfiles[key] = AbsPath(os.path.realpath(source))
+    return restartfiles
+
+@traced('initialize')
 def initialize():
 
     status.initialized = True
 
     script.meta = []
+    script.signal = []
+    script.envars = []
     script.vars = []
     script.config = []
     script.body = []
 
-#    for key, path in options.restartfiles.items():
-#        if not path.isfile():
-#            messages.error(_('El archivo de reinicio $path no existe', path=path))
-
     if options.remote.remote_host:
         (paths.home/'.ssh').mkdir()
         paths.socket = paths.home/'.ssh'/options.remote.remote_host*'sock'
@@ -38,6 +76,8 @@ def initialize():
         else:
             messages.error(_('El servidor $host no está configurado para aceptar trabajos', host=options.remote.remote_host))
 
+    settings.natoms = None
+
     if options.common.prompt:
         settings.defaults = False
     else:
@@ -65,12 +105,14 @@ def initialize():
                 path = AbsPath(path, parent=options.common.cwd)
                 molprefix = path.stem
                 coords = readmol(path)[-1]
+                settings.natoms = len(coords)
                 interpolationdict[f'mol{i}'] = molblock(coords, config.progspecfile)
         elif options.interpolation.trjmol:
             path = AbsPath(options.interpolation.trjmol, parent=options.common.cwd)
             molprefix = path.stem
             for i, coords in enumerate(readmol(path), start=1):
                 interpolationdict[f'mol{i}'] = molblock(coords, config.progspecfile)
+                settings.natoms = len(coords)
         if options.interpolation.prefix:
             try:
                 settings.prefix = InterpolationTemplate(options.interpolation.prefix).substitute(interpolationdict)
@@ -126,6 +168,72 @@ def initialize():
     else:
         messages.error(_('La lista de archivos de salida está vacía'), 'config.outputfiles')
 
+    if 'bundle' in options.common:
+        if options.common.bundle < 1:
+            messages.error(_('El tamaño de los paquetes debe ser un número positivo'), f'options.common.bundle={options.common.bundle}')
+        if options.remote.remote_host:
+            messages.error(_('No se pueden agrupar trabajos en un servidor remoto'))
+
+    if options.common.pilot and options.remote.remote_host:
+        messages.error(_('No se pueden encolar trabajos para los pilotos en un servidor remoto'))
+
+    if 'walltime' in options.common:
+        settings.walltime = parsewalltime(options.common.walltime)
+    else:
+        settings.walltime = None
+
+    if 'mem' in options.common:
+        settings.memory = parsememory(options.common.mem)
+    else:
+        settings.memory = None
+
+    if ('bundle' in options.common or options.common.pilot) and (options.common.autosize or settings.walltime or settings.memory):
+        messages.error(_('No se pueden solicitar recursos para cada trabajo con --bundle o --pilot'))
+
+    for key in config.syncfiles:
+        if not key in config.outputfiles:
+            messages.error(_('Elemento no encontrado'), f'{key} in config.syncfiles but not in config.outputfiles')
+
+    if 'sync_interval' in options.common:
+        settings.syncinterval = options.common.sync_interval
+    elif 'syncinterval' in config:
+        try:
+            settings.syncinterval = int(config.syncinterval)
+        except ValueError:
+            messages.error(_('Se esperaba un valor numérico'), f'syncinterval={config.syncinterval}')
+    else:
+        settings.syncinterval = None
+
+    if settings.syncinterval is not None:
+        if settings.syncinterval < 1:
+            messages.error(_('El intervalo de sincronización debe ser un número positivo'), f'syncinterval={settings.syncinterval}')
+        if not config.syncfiles:
+            messages.error(_('El programa no define archivos para sincronizar'), 'config.syncfiles')
+        if 'bundle' in options.common or options.common.pilot:
+            messages.error(_('No se pueden sincronizar los archivos de salida con --bundle o --pilot'))
+
+    # The heartbeat is written only when configured, because every write
+    # goes to the shared file system, and the stall detection of the
+    # programs works only with the heartbeat
+    try:
+        settings.heartbeat = int(config.get('heartbeat', 0))
+    except ValueError:
+        messages.error(_('Se esperaba un valor numérico'), f'heartbeat={config.heartbeat}')
+
+    if 'stall' in config:
+        try:
+            settings.stalltimeout = int(config.stall.get('timeout', 3600))
+        except ValueError:
+            messages.error(_('Se esperaba un valor numérico'), f'stall.timeout={config.stall.timeout}')
+        settings.stallaction = config.stall.get('action', 'warn')
+        if settings.stallaction not in stallstates:
+            messages.error(_('La acción para los trabajos estancados no es válida'), f'stall.action={settings.stallaction}')
+        if settings.stallaction == 'requeue' and not 'rquecmd' in config:
+            messages.error(_('No se especificó el comando para reencolar trabajos'), 'config.rquecmd')
+
+    if settings.restartfiles and options.remote.remote_host:
+        messages.error(_('No se pueden reiniciar trabajos en un servidor remoto'))
+
     if options.remote.remote_host:
         return
 
@@ -134,29 +242,51 @@ def initialize():
     if 'jobtype' in config:
         script.meta.append(ConfigTemplate(config.jobtype).substitute(jobtype=config.progname))
 
-    if 'queue' in options.common:
-        script.meta.append(ConfigTemplate(config.queue).substitute(queue=options.common.queue))
+    if 'signal' in config:
+        try:
+            signaltime = int(config.get('signaltime', 300))
+        except ValueError:
+            messages.error(_('Se esperaba un valor numérico'), f'signaltime={config.signaltime}')
+        script.signal.append(ConfigTemplate(config.signal).substitute(seconds=signaltime, minutes=ceil(signaltime/60)))
+
+    # The queue is selected once for all the jobs of the command, before
+    # the walltime of each job is estimated
+    if 'queue' in options.common and options.common.queue == 'auto':
+        if options.common.autosize:
+            messages.error(_('No se puede seleccionar la cola automáticamente con --autosize'))
+        settings.queue = selectqueue(options.common.nproc, settings.walltime)
+        messages.success(_('Se seleccionó la cola $queue', queue=settings.queue))
+    elif 'queue' in options.common:
+        settings.queue = options.common.queue
     elif 'queue' in config.defaults:
-        script.meta.append(ConfigTemplate(config.queue).substitute(queue=config.defaults.queue))
+        settings.queue = config.defaults.queue
+    else:
+        settings.queue = None
+
+    if settings.queue is not None:
+        script.meta.append(ConfigTemplate(config.queue).substitute(queue=settings.queue))
 
     #TODO MPI support for Slurm
     if config.parallel:
-        if config.parallel.lower() == 'none':
+        if config.parallel.lower() == 'none' and not 'bundle' in options.common:
             if 'hosts' in options.common:
                 for i, item in enumerate(config.serialat):
                     script.meta.append(ConfigTemplate(item).substitute(options.common))
             else:
                 for i, item in enumerate(config.serial):
                     script.meta.append(ConfigTemplate(item).substitute(options.common))
-        elif config.parallel.lower() == 'omp':
+        elif config.parallel.lower() in ('none', 'omp'):
             if 'hosts' in options.common:
                 for i, item in enumerate(config.singlehostat):
                     script.meta.append(ConfigTemplate(item).substitute(options.common))
             else:
                 for i, item in enumerate(config.singlehost):
                     script.meta.append(ConfigTemplate(item).substitute(options.common))
-            script.body.append(f'OMP_NUM_THREADS={options.common.nproc}')
+            if config.parallel.lower() == 'omp':
+                script.body.append('OMP_NUM_THREADS=$nproc')
         elif config.parallel.lower() == 'mpi':
+            if 'bundle' in options.common:
+                messages.error(_('No se pueden agrupar trabajos de programas paralelizados con MPI'), 'config.parallel=mpi')
             if 'hosts' in options.common:
                 for i, item in enumerate(config.multihostat):
                     script.meta.append(ConfigTemplate(item).substitute(options.common))
@@ -220,12 +350,12 @@ def initialize():
             path = InterpolationTemplate(path).safe_substitute(parameterdict)
             trunk = AbsPath()
             for part in AbsPath(path).parts:
-                trunk.assertdir()
+                assertparamdir(trunk)
                 try:
                     InterpolationTemplate(part).substitute()
                 except KeyError:
                     selector.set_message(_('Seleccione un conjunto de parámetros:'))
-                    selector.set_options(sorted(trunk.glob(InterpolationTemplate(part).substitute(GlobDict()))))
+                    selector.set_options(sorted(globparams(trunk, InterpolationTemplate(part).substitute(GlobDict()))))
                     choice = selector.single_choice()
                     parameterdict.update(template_parse(part, choice))
                     trunk = trunk/choice
@@ -269,12 +399,22 @@ def initialize():
         else:
             messages.error(_('El nombre del módulo es nulo'), 'config.load')
 
+    if 'nodecache' in config:
+        if config.filesync != 'local':
+            messages.error(_('La caché de parámetros en los nodos requiere que filesync sea local'), f'config.filesync={config.filesync}')
+        if not 'path' in config.nodecache:
+            messages.error(_('No se especificó la ruta de la caché de parámetros'), 'config.nodecache.path')
+        script.config.append(nodecache.format(
+            cachedir = AbsPath(ConfigTemplate(config.nodecache.path).substitute(names)),
+            maxsize = parsememory(config.nodecache.get('maxsize', '10G')),
+        ))
+
     for key, value in config.envars.items():
-        script.vars.append(f'{key}="{value}"')
+        script.envars.append(f'{key}="{value}"')
 
-    script.vars.append("totram=$(free | awk 'NR==2{print $2}')")
-    script.vars.append("totproc=$(getconf _NPROCESSORS_ONLN)")
-    script.vars.append("maxram=$(($totram*$nproc/$totproc))")
+    script.envars.append("totram=$(free | awk 'NR==2{print $2}')")
+    script.envars.append("totproc=$(getconf _NPROCESSORS_ONLN)")
+    script.envars.append("maxram=$(($totram*$nproc/$totproc))")
 
     for key, value in config.filevars.items():
         script.vars.append(f'{key}="{config.filekeys[value]}"')
@@ -318,29 +458,42 @@ def initialize():
     if config.filesync == 'local':
         script.makedir = 'mkdir -p -m 700 "{}"'.format
         script.removedir = 'rm -rf "{}"'.format
+        script.copyfile = 'cp "{}" "{}"'.format
         if options.common.move:
             script.importfile = 'mv "{}" "{}"'.format
         else:
-            script.importfile = 'cp "{}" "{}"'.format
+            script.importfile = script.copyfile
         script.importdir = 'cp -r "{}/." "{}"'.format
+        script.cacheimport = 'paramcache "{}" {} "{}"'.format
         script.exportfile = 'cp "{}" "{}"'.format
+        script.syncfile = 'cp "{0}" "{1}.part" && mv "{1}.part" "{1}"'.format
+        script.writefile = 'echo "{}" > "{}"'.format
     elif config.filesync == 'remote':
         script.makedir = 'for host in ${{hosts[*]}}; do rsh $host mkdir -p -m 700 "\'{}\'"; done'.format
         script.removedir = 'for host in ${{hosts[*]}}; do rsh $host rm -rf "\'{}\'"; done'.format
+        script.copyfile = 'for host in ${{hosts[*]}}; do rcp $headnode:"\'{0}\'" $host:"\'{1}\'"; done'.format
         if options.common.move:
             script.importfile = 'for host in ${{hosts[*]}}; do rcp $headnode:"\'{0}\'" $host:"\'{1}\'" && rsh $headnode rm "\'{0}\'"; done'.format
         else:
-            script.importfile = 'for host in ${{hosts[*]}}; do rcp $headnode:"\'{0}\'" $host:"\'{1}\'"; done'.format
+            script.importfile = script.copyfile
         script.importdir = 'for host in ${{hosts[*]}}; do rsh $host cp -r "\'{0}/.\'" "\'{1}\'"; done'.format
         script.exportfile = 'rcp "{}" $headnode:"\'{}\'"'.format
+        script.syncfile = 'rcp "{0}" $headnode:"\'{1}.part\'" && rsh $headnode mv "\'{1}.part\'" "\'{1}\'"'.format
+        script.writefile = 'echo "{}" | rsh $headnode "cat > \'{}\'"'.format
     elif config.filesync == 'secure':
         script.makedir = 'for host in ${{hosts[*]}}; do ssh $host mkdir -p -m 700 "\'{}\'"; done'.format
         script.removedir = 'for host in ${{hosts[*]}}; do ssh $host rm -rf "\'{}\'"; done'.format
+        script.copyfile = 'for host in ${{hosts[*]}}; do scp $headnode:"\'{0}\'" $host:"\'{1}\'"; done'.format
         if options.common.move:
             script.importfile = 'for host in ${{hosts[*]}}; do scp $headnode:"\'{0}\'" $host:"\'{1}\'" && ssh $headnode rm "\'{0}\'"; done'.format
         else:
-            script.importfile = 'for host in ${{hosts[*]}}; do scp $headnode:"\'{0}\'" $host:"\'{1}\'"; done'.format
+            script.importfile = script.copyfile
         script.importdir = 'for host in ${{hosts[*]}}; do ssh $host cp -r "\'{0}/.\'" "\'{1}\'"; done'.format
         script.exportfile = 'scp "{}" $headnode:"\'{}\'"'.format
+        script.syncfile = 'scp "{0}" $headnode:"\'{1}.part\'" && ssh $headnode mv "\'{1}.part\'" "\'{1}\'"'.format
+        script.writefile = 'echo "{}" | ssh $headnode "cat > \'{}\'"'.format
     else:
         messages.error(_('El método de copia no es válido'), 'config.filesync={config.filesync}')
+
+    # The invariant part of the job scripts is rendered once for the batch
+    script.skeleton = Skeleton()
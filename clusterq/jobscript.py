@@ -0,0 +1,224 @@
+from .shared import config, settings, script
+from .utils import ConfigTemplate, compiled_template
+
+# Copy a parameter set into the node cache once under a lock, hard link it
+# into the scratch directory (so that evicting it does not affect running
+# jobs) and evict the least recently used sets when the cache is too big.
+# Arguments are the source path, the cache key and the destination path,
+# and it fails without leaving a partial copy if the set can not be cached
+nodecache = '''paramcache () {{
+mkdir -p "{cachedir}"
+(
+flock 9
+if [[ ! -e "{cachedir}/$2" ]]; then
+rm -rf "{cachedir}/$2.part"
+if ! {{ cp -r "$1" "{cachedir}/$2.part" && find "{cachedir}/$2.part" -type f -exec chmod a-w {{}} + && mv "{cachedir}/$2.part" "{cachedir}/$2"; }}; then
+rm -rf "{cachedir}/$2.part"
+exit 1
+fi
+while (( $(du -sm "{cachedir}" | cut -f1) > {maxsize} )); do
+oldest=$(ls -tr "{cachedir}" | head -1)
+[[ $oldest == $2 ]] && break
+rm -rf "{cachedir}/$oldest"
+done
+fi
+touch "{cachedir}/$2"
+if [[ -d "{cachedir}/$2" ]]; then
+cp -rl "{cachedir}/$2/." "$3" 2> /dev/null || cp -r "{cachedir}/$2/." "$3"
+else
+ln -f "{cachedir}/$2" "$3" 2> /dev/null || cp "{cachedir}/$2" "$3"
+fi
+) 9> "{cachedir}.lock"
+}}'''
+
+# State written to the heartbeat when the job stalls for each stall action
+stallstates = {
+    'warn': 'stalled',
+    'kill': 'killed',
+    'requeue': 'requeued',
+}
+
+# Peak memory in bytes of the cgroup of the job (cgroup v2 only)
+peakmemory = 'peak=$(cat "/sys/fs/cgroup$(awk -F: \'$1 == 0 {print $3}\' /proc/self/cgroup)/memory.peak" 2> /dev/null)'
+
+class Skeleton:
+# Job script with everything but the job name, the imports and the exports
+# rendered in advance
+    def __init__(self):
+        self.head = ''.join(i + '\n' for i in ['#!/bin/bash -x'] + script.meta)
+        self.vars = ''.join(i + '\n' for i in ['shopt -s extglob nullglob'] + script.envars + script.vars)
+        self.taskvars = ''.join(i + '\n' for i in ['shopt -s extglob nullglob'] + script.vars)
+        self.config = ''.join(i + '\n' for i in script.config)
+        self.setup = self.config + script.makedir(settings.execdir) + '\n'
+        self.program = ''.join(i + '\n' for i in ['start=$(date +%s)'] + config.prescript + [' '.join(script.body), 'status=$?'])
+        self.signal = ''.join(i + '\n' for i in script.signal)
+        self.background = ''.join(i + '\n' for i in ['start=$(date +%s)'] + config.prescript + [' '.join(script.body) + ' &', 'pid=$!'])
+        self.wait = 'wait $pid\nstatus=$?\n'
+        self.postscript = ''.join(i + '\n' for i in config.postscript)
+        self.peak = peakmemory + '\n'
+        self.offscript = ''.join(i + '\n' for i in config.offscript)
+        self.cleanup = script.removedir(settings.execdir) + '\n' + self.offscript
+        self.jobname = compiled_template(ConfigTemplate, config.jobname)
+    def stats(self, jobdir):
+# Start and end times, exit status and peak memory of the job, which are
+# harvested into the job history
+        return script.writefile('$start $(date +%s) $status $peak', jobdir/'stats') + '\n'
+    def syncloop(self, syncfiles):
+# Copy the files modified since the last pass to the output directory
+# while the program runs, renaming them into place so that an interrupted
+# copy does not clobber the previous one
+        if not syncfiles:
+            return ''
+        return ''.join((
+            'syncstamp=$(mktemp)\n',
+            f'while sleep {settings.syncinterval}; do\n',
+            'touch "$syncstamp.new"\n',
+            ''.join(f'[[ "{source}" -nt "$syncstamp" ]] && ' + script.syncfile(source, target) + '\n' for source, target in syncfiles),
+            'mv "$syncstamp.new" "$syncstamp"\n',
+            'done &\n',
+            'syncpid=$!\n',
+        ))
+    def syncstop(self, syncfiles):
+        if not syncfiles:
+            return ''
+        return 'kill $syncpid\nrm -f "$syncstamp" "$syncstamp.new"\n'
+    def monitor(self, jobdir, livefile):
+# Write a heartbeat with the time of the last growth of the output file
+# and act on the job when it made no progress for longer than the stall
+# timeout of the program
+        if livefile is None or not settings.heartbeat:
+            return ''
+        if 'stall' in config:
+            stalled = ''.join((
+                f'if (( now - progress > {settings.stalltimeout} )); then\n',
+                f'state={stallstates[settings.stallaction]}\n',
+                'fi\n',
+            ))
+        else:
+            stalled = ''
+        if 'stall' in config and settings.stallaction != 'warn':
+            action = ''.join((
+                'if [[ $state != running ]]; then\n',
+                'kill -TERM $pid\n' if settings.stallaction == 'kill' else ' '.join(config.rquecmd) + ' $jobid\n',
+                'break\n',
+                'fi\n',
+            ))
+        else:
+            action = ''
+        return ''.join((
+            'progress=$(date +%s)\n',
+            f'while sleep {settings.heartbeat}; do\n',
+            'now=$(date +%s)\n',
+            f'size=$(stat -c "%s %Y" "{livefile[0]}" 2> /dev/null)\n',
+            'if [[ $size != $lastsize ]]; then\n',
+            'lastsize=$size\n',
+            'progress=$now\n',
+            'fi\n',
+            'state=running\n',
+            stalled,
+            script.writefile(f'$now $progress {settings.heartbeat} $state', jobdir/'heartbeat') + '\n',
+            action,
+            'done &\n',
+            'heartpid=$!\n',
+        ))
+    def monitorstop(self, livefile):
+        if livefile is None or not settings.heartbeat:
+            return ''
+        return 'kill $heartpid 2> /dev/null\n'
+    def stageout(self, exports, jobdir, syncfiles, livefile):
+# Stop the program and copy back its output when the job is killed or
+# warned by the scheduler that it will be killed, so that it can be
+# restarted from its last checkpoint
+        return ''.join((
+            'stageout () {\n',
+            "trap '' TERM USR1\n",
+            'if [[ -z $status ]]; then\n',
+            'status=$1\n',
+            '[[ -n $pid ]] && kill -TERM $pid && wait $pid\n',
+            'fi\n',
+            self.syncstop(syncfiles),
+            self.monitorstop(livefile),
+            self.peak,
+            ''.join(i + '\n' for i in exports),
+            self.stats(jobdir),
+            self.cleanup,
+            'exit $status\n',
+            '}\n',
+            "trap 'stageout 143' TERM\n",
+            "trap 'stageout 138' USR1\n",
+        ))
+    def info(self, jobdir, livefile):
+# Host and path of the main output file while the job runs and its path
+# once copied back, which are read by clusterq tail
+        if livefile is None:
+            return ''
+        return script.writefile('$(hostname)\n{}\n{}'.format(*livefile), jobdir/'info') + '\n'
+    def render(self, jobname, imports, exports, jobdir, meta=[], jobvars=[], syncfiles=[], livefile=None):
+        return ''.join((
+            self.head,
+            self.signal,
+            self.jobname.substitute(jobname=jobname) + '\n',
+            ''.join(i + '\n' for i in meta),
+            self.vars,
+            f'jobname="{jobname}"\n',
+            ''.join(i + '\n' for i in jobvars),
+            self.stageout(exports, jobdir, syncfiles, livefile),
+            self.setup,
+            ''.join(i + '\n' for i in imports),
+            script.chdir(settings.execdir) + '\n',
+            self.info(jobdir, livefile),
+            self.background,
+            self.syncloop(syncfiles),
+            self.monitor(jobdir, livefile),
+            self.wait,
+            self.syncstop(syncfiles),
+            self.monitorstop(livefile),
+            self.postscript,
+            self.peak,
+            ''.join(i + '\n' for i in exports),
+            self.stats(jobdir),
+            self.cleanup,
+        ))
+    def steps(self, jobname, execdir, imports, exports, jobdir):
+# Run one input in its own directory and record its exit code
+        return ''.join((
+            f'jobname="{jobname}"\n',
+            script.makedir(execdir) + '\n',
+            ''.join(i + '\n' for i in imports),
+            script.chdir(execdir) + '\n',
+            self.program,
+            self.postscript,
+            self.peak,
+            ''.join(i + '\n' for i in exports),
+            self.stats(jobdir),
+            script.removedir(execdir) + '\n',
+            script.writefile('$status', jobdir/'exit') + '\n',
+        ))
+    def task(self, index, jobname, execdir, imports, exports, jobdir):
+# Shell function that runs one input of a bundle
+        return f'task{index} () {{\n' + self.steps(jobname, execdir, imports, exports, jobdir) + '}\n'
+    def pilottask(self, jobname, execdir, imports, exports, jobdir):
+# Self-contained task sourced by a pilot job, which defines the job
+# variables (jobid, nproc, hosts, maxram...) beforehand
+        return ''.join((
+            self.taskvars,
+            self.config,
+            self.steps(jobname, execdir, imports, exports, jobdir),
+            'exit $status\n',
+        ))
+    def launcher(self, jobname, tasks):
+# Run the tasks concurrently using one core for each of them
+        return ''.join((
+            self.head,
+            self.jobname.substitute(jobname=jobname) + '\n',
+            self.vars,
+            f'jobname="{jobname}"\n',
+            self.config,
+            ''.join(tasks),
+            'for task in ' + ' '.join(f'task{i}' for i in range(1, len(tasks) + 1)) + '; do\n',
+            'while (( $(jobs -rp | wc -l) >= nproc )); do wait -n; done\n',
+            '( nproc=1; maxram=$(($totram*$nproc/$totproc)); $task ) &\n',
+            'done\n',
+            'wait\n',
+            self.offscript,
+        ))
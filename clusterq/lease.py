@@ -0,0 +1,90 @@
+import os
+import time
+import fcntl
+from contextlib import contextmanager
+from .shared import names, config
+
+# A job directory is claimed for the duration of a submission by creating
+# its lock file exclusively, which is atomic on local and NFS file systems.
+# The lock records the host, process and time of the claim, so that the
+# claim of a process that died can be recovered: at once on the same host,
+# where it can be checked that the process no longer exists, and after the
+# lease time on any host. The lock is only removed, to release or recover
+# it, while holding an flock on the guard file, which the system drops if
+# the process dies, so that it cannot change between being checked and
+# being removed.
+
+held = {}
+
+def readlock(path):
+# Host, process and time of the claim, None if the lock is gone and an
+# empty tuple if it is not completely written
+    try:
+        with open(path, 'r') as f:
+            host, pid, stamp = f.read().split()
+        return host, int(pid), float(stamp)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        return ()
+
+def stale(path, holder):
+    leasetime = float(config.get('leasetime', 600))
+    if not holder:
+        try:
+            return time.time() - os.stat(path).st_mtime > leasetime
+        except FileNotFoundError:
+            return False
+    host, pid, stamp = holder
+    # The process may have been replaced by another with the same pid
+    if time.time() - stamp > leasetime:
+        return True
+    if host == names.host:
+        if pid == os.getpid():
+            return holder not in held.values()
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+    return False
+
+@contextmanager
+def guard(jobdir):
+    with open(jobdir/'lock.guard', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def acquire(jobdir):
+# Return None when the directory was claimed or the holder of the claim
+    path = jobdir/'lock'
+    claim = names.host, os.getpid(), time.time()
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            with guard(jobdir):
+                holder = readlock(path)
+                if holder is None:
+                    continue
+                if not stale(path, holder):
+                    return f'{holder[1]}@{holder[0]}' if holder else '?'
+                os.remove(path)
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write(' '.join(map(str, claim)))
+            held[path] = claim
+            return None
+
+def release(jobdir):
+# Remove the lock only if it is still the one written by this claim
+    path = jobdir/'lock'
+    claim = held.pop(path, None)
+    if claim is not None:
+        with guard(jobdir):
+            if readlock(path) == claim:
+                os.remove(path)
@@ -0,0 +1,157 @@
+import os
+import sys
+import json
+import time
+import shlex
+import fcntl
+import signal
+from subprocess import Popen, DEVNULL, STDOUT
+
+# Jobs are run on this machine by a detached runner process for each job.
+# The runners take turns with an admission lock to acquire one slot lock
+# for each core requested and hold them while the job script runs, so at
+# most as many cores as slots are in use at any time. The state of each job
+# is kept in the file jobs/<jobid>/state of the queue directory.
+
+def writestate(jobdir, state):
+    with open(os.path.join(jobdir, 'state.tmp'), 'w') as f:
+        f.write(state)
+    os.replace(os.path.join(jobdir, 'state.tmp'), os.path.join(jobdir, 'state'))
+
+def readstate(jobdir):
+    try:
+        with open(os.path.join(jobdir, 'state'), 'r') as f:
+            state = f.read()
+    except FileNotFoundError:
+        return None
+    if state in ('PENDING', 'RUNNING'):
+        # The runner died without updating the state
+        try:
+            with open(os.path.join(jobdir, 'pid'), 'r') as f:
+                os.kill(int(f.read()), 0)
+        except ProcessLookupError:
+            return 'FAILED'
+        except (FileNotFoundError, ValueError, PermissionError):
+            pass
+    return state
+
+def parsedirectives(jobscript):
+    directives = {}
+    with open(jobscript, 'r') as f:
+        for line in f:
+            if line.startswith('#LOCAL'):
+                args = shlex.split(line[len('#LOCAL'):])
+                for option, value in zip(args[::2], args[1::2]):
+                    directives[option] = value
+            elif line.strip() and not line.startswith('#'):
+                break
+    return directives
+
+class LocalBackend:
+    def __init__(self, queuedir, slots):
+        self.queuedir = queuedir
+        self.slots = slots
+        for subdir in ('jobs', 'slots'):
+            os.makedirs(os.path.join(queuedir, subdir), exist_ok=True)
+    def newjobid(self):
+        with open(os.path.join(self.queuedir, 'lastid'), 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            jobid = str(int(f.read() or 0) + 1)
+            f.seek(0)
+            f.truncate()
+            f.write(jobid)
+        return jobid
+    def submit(self, jobscript):
+        directives = parsedirectives(jobscript)
+        nproc = int(directives.get('-n', 1))
+        if nproc > self.slots:
+            raise RuntimeError(f'Se requirieron {nproc} núcleos pero sólo hay {self.slots} disponibles')
+        jobid = self.newjobid()
+        jobdir = os.path.join(self.queuedir, 'jobs', jobid)
+        os.makedirs(jobdir)
+        with open(os.path.join(jobdir, 'info.json'), 'w') as f:
+            json.dump(dict(
+                jobid = jobid,
+                script = os.path.abspath(jobscript),
+                cwd = os.getcwd(),
+                nproc = nproc,
+                slots = self.slots,
+                name = directives.get('-J'),
+                log = directives.get('-o', os.devnull).replace('%j', jobid),
+                dependency = directives.get('-d'),
+            ), f)
+        writestate(jobdir, 'PENDING')
+        process = Popen([sys.executable, '-m', 'clusterq.localqueue', self.queuedir, jobid], stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL, start_new_session=True)
+        with open(os.path.join(jobdir, 'pid'), 'w') as f:
+            f.write(str(process.pid))
+        return jobid
+    def status(self, jobid):
+        return readstate(os.path.join(self.queuedir, 'jobs', jobid))
+    def cancel(self, jobid):
+        jobdir = os.path.join(self.queuedir, 'jobs', jobid)
+        if readstate(jobdir) not in ('PENDING', 'RUNNING'):
+            raise RuntimeError(f'El trabajo {jobid} no está en la cola')
+        writestate(jobdir, 'CANCELLED')
+        with open(os.path.join(jobdir, 'pid'), 'r') as f:
+            try:
+                os.killpg(int(f.read()), signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+def acquireslots(queuedir, nproc, slots):
+# The admission lock is held until all the slots are acquired so that
+# jobs requesting many cores are not starved by smaller ones
+    locks = {}
+    with open(os.path.join(queuedir, 'admission'), 'a') as admission:
+        fcntl.flock(admission, fcntl.LOCK_EX)
+        while len(locks) < nproc:
+            for i in range(slots):
+                if i in locks or len(locks) == nproc:
+                    continue
+                lock = open(os.path.join(queuedir, 'slots', str(i)), 'a')
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    lock.close()
+                else:
+                    locks[i] = lock
+            if len(locks) < nproc:
+                time.sleep(1)
+    return list(locks.values())
+
+def runjob(queuedir, jobid):
+    jobdir = os.path.join(queuedir, 'jobs', jobid)
+    with open(os.path.join(jobdir, 'info.json'), 'r') as f:
+        info = json.load(f)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(143))
+    if info['dependency']:
+        while readstate(os.path.join(queuedir, 'jobs', info['dependency'])) in ('PENDING', 'RUNNING'):
+            time.sleep(5)
+        if readstate(os.path.join(queuedir, 'jobs', info['dependency'])) != 'COMPLETED':
+            writestate(jobdir, 'CANCELLED')
+            return
+    # The slots are held by the flocks on the open files of locks until the
+    # final state is written, or until this process exits
+    locks = acquireslots(queuedir, info['nproc'], info['slots'])
+    if readstate(jobdir) == 'CANCELLED':
+        return
+    writestate(jobdir, 'RUNNING')
+    env = dict(os.environ, CLUSTERQ_JOBID=jobid, CLUSTERQ_NPROC=str(info['nproc']))
+    if os.path.dirname(info['log']):
+        os.makedirs(os.path.dirname(info['log']), exist_ok=True)
+    with open(info['log'], 'a') as log:
+        process = Popen(['/bin/bash', info['script']], cwd=info['cwd'], env=env, stdin=DEVNULL, stdout=log, stderr=STDOUT)
+        try:
+            returncode = process.wait()
+        except SystemExit:
+            process.terminate()
+            process.wait()
+            raise
+    if readstate(jobdir) != 'CANCELLED':
+        writestate(jobdir, 'COMPLETED' if returncode == 0 else 'FAILED')
+    for lock in locks:
+        lock.close()
+
+if __name__ == '__main__':
+    runjob(*sys.argv[1:])
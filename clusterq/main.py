@@ -3,11 +3,19 @@ from socket import gethostname
 #from tkdialogs import messages
 from clinterface import messages, _
 from argparse import ArgumentParser, Action, SUPPRESS
-from .utils import AttrDict, LogDict, GlobDict, ConfigTemplate, InterpolationTemplate, option, readspec, natural_sorted as sorted, catch_keyboard_interrupt
+from .utils import AttrDict, LogDict, GlobDict, ConfigTemplate, InterpolationTemplate, option, natural_sorted as sorted, catch_keyboard_interrupt
 from .fileutils import AbsPath, file_except_info
-from .shared import names, nodes, paths, environ, config, options
+from .shared import names, environ, config, options, settings
 from .parsing import BoolParser
-from .submission import submit
+from .submission import submit, parameterpath
+from .initialization import findrestartfiles
+from .bundling import flushbundle
+from .workflow import loadworkflow, submitworkflow
+from .configuration import loadconfig
+from .tracing import tracer, span
+from .paramindex import assertparamdir, globparams, saveindex, newbatch
+from .resume import scanjobs
+from .retry import replayargs
 
 class ArgList:
     def __init__(self, args):
@@ -56,7 +64,7 @@ class ArgList:
         filestatus = {}
         for key in config.filekeys:
             path = workdir/inputname*key
-            filestatus[key] = path.isfile() #or key in options.restartfiles
+            filestatus[key] = path.isfile() or key in settings.restartfiles
         for conflict, message in config.conflicts.items():
             if BoolParser(conflict).evaluate(filestatus):
                 messages.failure(InterpolationTemplate(message).safe_substitute(file=inputname))
@@ -83,6 +91,7 @@ class ListOptions(Action):
             if dirtree:
                 print('Conjuntos de parámetros disponibles:')
                 print_tree(dirtree, level=1)
+        saveindex()
         raise SystemExit
 
 class StorePath(Action):
@@ -99,12 +108,12 @@ class AppendPath(Action):
         setattr(namespace, self.dest, AbsPath(values[0], parent=os.getcwd()))
 
 def dirbranches(trunk, componentlist, dirtree):
-    trunk.assertdir()
+    assertparamdir(trunk)
     if componentlist:
         defaultdict = LogDict()
         component = ConfigTemplate(componentlist.pop(0)).substitute(defaultdict)
         if defaultdict.logged_keys:
-            branches = trunk.glob(ConfigTemplate(component).substitute(GlobDict()))
+            branches = globparams(trunk, ConfigTemplate(component).substitute(GlobDict()))
             for branch in branches:
                 dirtree[branch] = {}
                 dirbranches(trunk/branch, componentlist, dirtree[branch])
@@ -112,51 +121,7 @@ def dirbranches(trunk, componentlist, dirtree):
             dirbranches(trunk/component, componentlist, dirtree)
 
 
-@catch_keyboard_interrupt
-def run():
-
-    paths.cfgdir = AbsPath(os.environ['CLUSTERQCFG'])
-    names.command = os.path.basename(sys.argv[1])
-    sys.argv.pop(1)
-
-    config.merge(readspec(paths.cfgdir/'profiles'/'__cluster__.json5'))
-    config.merge(readspec(paths.cfgdir/'profiles'/names.command*'json5'))
-    config.merge(readspec(paths.cfgdir/'progspecs'/config.progspecfile))
-    config.merge(readspec(paths.cfgdir/'queuespecs'/config.queuespecfile))
-
-    userconfdir = paths.home/'.clusterq'
-    userclusterconf = userconfdir/'__cluster__.json5'
-    userpackageconf = userconfdir/names.command*'json5'
-    
-    try:
-        config.merge(readspec(userclusterconf))
-    except FileNotFoundError:
-        pass
-
-    try:
-        config.merge(readspec(userpackageconf))
-    except FileNotFoundError:
-        pass
-
-    try:
-        config.progname
-    except AttributeError:
-        messages.error(_('No se definió el nombre del programa'))
-
-    try:
-        config.displayname
-    except AttributeError:
-        messages.error(_('No se definió el nombre del programa para mostrar'))
-
-    try:
-        names.cluster = config.clustername
-    except AttributeError:
-        messages.error(_('No se definió el nombre del clúster'))
-
-    try:
-        nodes.head = config.headnode
-    except AttributeError:
-        nodes.head = names.host
+def makeparser():
 
     parser = ArgumentParser(prog=names.command, add_help=False, description='Envía trabajos de {} a la cola de ejecución.'.format(config.displayname))
 
@@ -172,19 +137,30 @@ def run():
     group2.add_argument('-v', '--version', metavar='VERSION', default=SUPPRESS, help='Usar la versión VERSION del ejecutable.')
     group2.add_argument('-p', '--prompt', action='store_true', help='Seleccionar interactivamente las opciones disponibles.')
     group2.add_argument('-n', '--nproc', type=int, metavar='#PROCS', default=1, help='Requerir #PROCS núcleos de procesamiento.')
-    group2.add_argument('-q', '--queue', metavar='QUEUE', default=SUPPRESS, help='Requerir la cola QUEUE.')
+    group2.add_argument('-q', '--queue', metavar='QUEUE', default=SUPPRESS, help='Requerir la cola QUEUE (auto para elegir la cola con menos espera).')
     group2.add_argument('-j', '--job', action='store_true', help='Interpretar los argumentos como nombres de trabajo en vez de rutas de archivo.')
     group2.add_argument('-o', '--out', action=StorePath, metavar='PATH', default=SUPPRESS, help='Escribir los archivos de salida en el directorio PATH.')
     group2.add_argument('--cwd', action=StorePath, metavar='PATH', default=os.getcwd(), help='Usar PATH como directorio actual de trabajo.')
     group2.add_argument('--raw', action='store_true', help='No interpolar ni crear copias de los archivos de entrada.')
     group2.add_argument('--move', action='store_true', help='Mover los archivos de entrada al directorio de salida en vez de copiarlos.')
     group2.add_argument('--scratch', action=StorePath, metavar='PATH', default=SUPPRESS, help='Escribir los archivos temporales en el directorio PATH.')
+    group2.add_argument('--walltime', metavar='TIME', default=SUPPRESS, help='Requerir un tiempo de ejecución TIME (minutos o [días-]horas:minutos[:segundos]).')
+    group2.add_argument('--mem', metavar='MEMORY', default=SUPPRESS, help='Requerir la cantidad de memoria MEMORY (por ejemplo 500M o 4G).')
+    group2.add_argument('--autosize', action='store_true', help='Estimar el tiempo de ejecución y la memoria a partir de los trabajos anteriores.')
+    group2.add_argument('--sync-interval', type=int, metavar='SECONDS', default=SUPPRESS, help='Copiar los archivos de salida al directorio de salida cada SECONDS segundos mientras corre el trabajo.')
+    group2.add_argument('--no-reuse', action='store_true', help='Enviar el trabajo aunque ya se hayan calculado los resultados de un trabajo idéntico.')
+    group2.add_argument('--retry-of', metavar='JOBID', default=SUPPRESS, help=SUPPRESS)
+    group2.add_argument('--workflow', metavar='FILE', default=SUPPRESS, help='Enviar cada archivo de entrada como una cadena de trabajos definida en el archivo FILE.')
+    farmgroup = group2.add_mutually_exclusive_group()
+    farmgroup.add_argument('--bundle', type=int, metavar='SIZE', default=SUPPRESS, help='Correr hasta SIZE archivos de entrada en un mismo trabajo usando un núcleo por archivo.')
+    farmgroup.add_argument('--pilot', action='store_true', help='Agregar los trabajos a la cola de los pilotos en vez de enviarlos al gestor de trabajos.')
     hostgroup = group2.add_mutually_exclusive_group()
     hostgroup.add_argument('-N', '--nhost', type=int, metavar='#NODES', default=1, help='Requerir #NODES nodos de ejecución.')
     hostgroup.add_argument('-H', '--hosts', metavar='NODE', default=SUPPRESS, help='Solicitar nodos específicos de ejecución.')
     yngroup = group2.add_mutually_exclusive_group()
     yngroup.add_argument('--yes', action='store_true', help='Responder "si" a todas las preguntas.')
     yngroup.add_argument('--no', action='store_true', help='Responder "no" a todas las preguntas.')
+    yngroup.add_argument('--resume', action='store_true', help='Enviar únicamente los trabajos que no terminaron correctamente.')
 
     group3 = parser.add_argument_group('Opciones remotas')
     group3.name = 'remote'
@@ -196,7 +172,7 @@ def run():
     sortgroup.add_argument('-s', '--sort', action='store_true', help='Ordenar los argumentos en orden ascendente.')
     sortgroup.add_argument('-S', '--sort-reverse', action='store_true', help='Ordenar los argumentos en orden descendente.')
     group4.add_argument('-f', '--filter', metavar='REGEX', default=SUPPRESS, help='Enviar únicamente los trabajos que coinciden con la expresión regular.')
-#    group4.add_argument('-r', '--restart-file', dest='restartfiles', metavar='FILE', action='append', default=[], help='Restart file path.')
+    group4.add_argument('-r', '--restart', metavar='JOB', action='append', default=[], help='Reiniciar a partir de los archivos de salida del trabajo JOB (directorio de salida o archivo).')
 
     group5 = parser.add_argument_group('Opciones de interpolación')
     group5.name = 'interpolation'
@@ -211,6 +187,9 @@ def run():
     group7 = parser.add_argument_group('Opciones de depuración')
     group7.name = 'debug'
     group7.add_argument('--dry-run', action='store_true', help='Procesar los archivos de entrada sin enviar el trabajo.')
+    group7.add_argument('--timings', action='store_true', help='Mostrar un resumen de los tiempos de cada fase al terminar.')
+    group7.add_argument('--trace', metavar='FILE', default=None, help='Escribir las trazas de cada trabajo y fase en el archivo FILE.')
+    group7.add_argument('--trace-format', choices=('jsonl', 'chrome'), default='jsonl', help='Formato del archivo de trazas (JSON lines o Chrome trace).')
 
     group8 = parser.add_argument_group('Conjuntos de parámetros')
     group8.name = 'parameteropts'
@@ -222,7 +201,11 @@ def run():
     for key in config.interpolopts:
         group9.add_argument(option(key), metavar='VARNAME', default=SUPPRESS, help='Variables de interpolación.')
 
-    parsedargs = parser.parse_args()
+    return parser
+
+def setoptions(parser, arglist=None):
+# Parse the arguments into the option groups and return the input files
+    parsedargs = parser.parse_args(arglist)
 #    print(parsedargs)
 
     for group in parser._action_groups:
@@ -230,10 +213,66 @@ def run():
         if hasattr(group, 'name'):
             options[group.name] = AttrDict(**group_dict)
 
-    if not parsedargs.files:
+    return parsedargs.files
+
+def submitall(files):
+# Submit the jobs of the input files as a single batch and return the
+# results of the jobs that were processed
+
+    newbatch()
+    parameterpath.cache_clear()
+    settings.restartfiles = findrestartfiles(options.arguments.restart)
+
+    if 'workflow' in options.common:
+        steps = loadworkflow(options.common.workflow)
+
+    arguments = ArgList(list(files))
+
+    if options.common.resume:
+        arguments = list(arguments)
+        settings.completed = scanjobs(arguments, steps if 'workflow' in options.common else [None])
+    else:
+        settings.completed = set()
+
+    results = []
+
+    try:
+        for workdir, inputname, filtergroups in arguments:
+            with span('job', input=inputname):
+                if 'workflow' in options.common:
+                    result = submitworkflow(steps, workdir, inputname, filtergroups)
+                else:
+                    result = submit(workdir, inputname, filtergroups)
+            if result is not None:
+                results.append(result)
+        flushbundle()
+    finally:
+        saveindex()
+
+    return results
+
+@catch_keyboard_interrupt
+def run():
+
+    names.command = os.path.basename(sys.argv[1])
+    sys.argv.pop(1)
+
+    loadconfig(os.environ.get('CLUSTERQCFG'), names.command)
+
+    parser = makeparser()
+    files = setoptions(parser)
+
+    tracer.configure(
+        timings = options.debug.timings,
+        trace = options.debug.trace,
+        format = options.debug.trace_format,
+        hookspecs = config.tracehooks,
+    )
+
+    if not files:
         messages.error(_('Debe especificar al menos un archivo de entrada'))
 
-    arguments = ArgList(parsedargs.files)
+    settings.arglist = replayargs(parser, sys.argv[1:])
 
     try:
         environ.TELEGRAM_BOT_URL = os.environ['TELEGRAM_BOT_URL']
@@ -241,9 +280,11 @@ def run():
     except KeyError:
         pass
 
-    for workdir, inputname, filtergroups in arguments:
-        submit(workdir, inputname, filtergroups)
-    
+    try:
+        submitall(files)
+    finally:
+        tracer.finish()
+
 
 if __name__ == '__main__':
     run()
@@ -0,0 +1,97 @@
+import os
+import time
+from argparse import ArgumentParser
+from clinterface import messages, _
+from .shared import names, config
+from .fileutils import AbsPath
+from .history import database
+from .queue import getbackend
+from .retry import retryjobs
+from .configuration import loadconfig
+
+# The heartbeat is stale when it was not written for this many intervals,
+# which means that the node or the job script hung
+staleintervals = 3
+
+def readheartbeat(jobdir):
+# Time of the last heartbeat, time of the last progress of the output file,
+# heartbeat interval and state written by the job script
+    try:
+        with open(jobdir/'heartbeat', 'r') as f:
+            beat, progress, interval, state = f.read().split()
+        return int(beat), int(progress), int(interval), state
+    except (FileNotFoundError, NotADirectoryError, ValueError):
+        return None
+
+def age(seconds):
+    if seconds < 120:
+        return f'{seconds:.0f}s'
+    elif seconds < 7200:
+        return f'{seconds/60:.0f}m'
+    else:
+        return f'{seconds/3600:.1f}h'
+
+def clusterq_status(arglist):
+
+    parser = ArgumentParser(prog='clusterq status', description='Muestra el estado y el latido de los trabajos en curso y reenvía los que fallaron si se activa retry.auto en la configuración.')
+    parser.add_argument('dirs', nargs='*', metavar='PATH', help='Directorios de salida de los trabajos (por defecto todos los trabajos en curso).')
+    parser.add_argument('--cfgdir', metavar='PATH', default=os.environ.get('CLUSTERQCFG'), help='Usar la configuración del directorio PATH.')
+    args = parser.parse_args(arglist)
+
+    loadconfig(args.cfgdir)
+
+    jobs = []
+    if args.dirs:
+        for path in args.dirs:
+            outdir = AbsPath(path, parent=os.getcwd())
+            try:
+                with open(outdir/'.job'/'id', 'r') as f:
+                    jobs.append((f.read(), outdir.name, outdir))
+            except FileNotFoundError:
+                messages.failure(_('No se envió ningún trabajo desde el directorio $path', path=outdir))
+    else:
+        final = list(config.finished_states)
+        for jobid, jobname, outdir in database().execute(f"select jobid, jobname, outdir from jobs where cluster = ? and user = ? and finished is null and (state is null or state not in ({','.join('?'*len(final))})) order by submitted", [names.cluster, names.user] + final):
+            jobs.append((jobid, jobname, AbsPath(outdir)))
+
+    table = []
+    stale = 0
+    now = time.time()
+    for jobid, jobname, outdir in jobs:
+        try:
+            state = getbackend().status(jobid)
+        except (LookupError, RuntimeError):
+            state = '?'
+        if state is None or state in config.finished_states:
+            if args.dirs:
+                table.append([jobname, jobid, state or '-', '-', '-', _('terminado')])
+            continue
+        heartbeat = readheartbeat(outdir/'.job')
+        if heartbeat is None:
+            table.append([jobname, jobid, state, '-', '-', '-'])
+            continue
+        beat, progress, interval, beatstate = heartbeat
+        if now - beat > staleintervals*interval:
+            diagnosis = _('sin latido')
+            stale += 1
+        elif beatstate != 'running':
+            diagnosis = _('estancado')
+            stale += 1
+        else:
+            diagnosis = _('activo')
+        table.append([jobname, jobid, state, age(now - beat), age(beat - progress), diagnosis])
+
+    if not table:
+        messages.success(_('No hay trabajos en curso en $clustername', clustername=names.cluster))
+    else:
+        headers = [_('trabajo'), _('número'), _('estado'), _('latido'), _('sin progreso'), _('diagnóstico')]
+        widths = [max(len(line[i]) for line in [headers] + table) for i in range(len(headers))]
+        for line in [headers] + table:
+            print('  '.join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+    if stale:
+        messages.warning(_('Hay $count trabajo(s) estancados o sin latido', count=stale))
+
+    # Failed jobs are resubmitted without running clusterq retry
+    if config.get('retry', {}).get('auto'):
+        retryjobs()
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import fnmatch
+from hashlib import sha1
+from functools import lru_cache
+from stat import S_ISDIR, S_ISREG
+from .shared import config, names, paths, paramindex
+from .utils import ConfigTemplate, FilterGroupTemplate, InterpolationTemplate, GlobDict
+from .fileutils import AbsPath
+
+# Listings of the parameter set directories are kept in a JSON file. Each
+# directory is checked once per batch with a stat call and listed again
+# only when its modification time changed, so that large libraries on
+# network file systems are not listed on every submission. The entries are
+# mapped to 'd' for directories, 'f' for regular files and '' otherwise.
+# The listings and the directories already checked belong to the session.
+
+def indexfile():
+    if 'paramindex' in config:
+        return AbsPath(ConfigTemplate(config.paramindex).substitute(names))
+    else:
+        return paths.home/'.clusterq'/'paramindex.json'
+
+def loadindex():
+    if not paramindex.loaded:
+        try:
+            with open(indexfile(), 'r') as f:
+                paramindex.listings.update(json.load(f))
+        except (FileNotFoundError, ValueError):
+            pass
+        paramindex.loaded = True
+
+def saveindex():
+    if paramindex.dirty:
+        path = indexfile()
+        path.parent().makedirs()
+        with open(f'{path}.{os.getpid()}', 'w') as f:
+            json.dump(paramindex.listings, f)
+        os.replace(f'{path}.{os.getpid()}', path)
+        paramindex.dirty = False
+
+def newbatch():
+# Check the directories and the contents of the parameter sets again, for
+# sessions that submit many batches
+    paramindex.verified.clear()
+    contentkey.cache_clear()
+
+def scandir(path):
+    listing = {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                listing[entry.name] = 'd'
+            elif entry.is_file():
+                listing[entry.name] = 'f'
+            else:
+                listing[entry.name] = ''
+    return listing
+
+def entries(path, rebuild=False):
+# Listing of the directory or None if it is not a directory
+    loadindex()
+    if path in paramindex.verified:
+        return paramindex.listings[path][1] if path in paramindex.listings else None
+    paramindex.verified.add(path)
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        stat = None
+    if stat is None or not S_ISDIR(stat.st_mode):
+        if paramindex.listings.pop(path, None) is not None:
+            paramindex.dirty = True
+        return None
+    if rebuild or path not in paramindex.listings or paramindex.listings[path][0] != stat.st_mtime_ns:
+        # A listing taken within the timestamp granularity of the file
+        # system could miss later changes, so it is not trusted next time
+        mtime = stat.st_mtime_ns if time.time() - stat.st_mtime > 2 else None
+        paramindex.listings[path] = [mtime, scandir(path)]
+        paramindex.dirty = True
+    return paramindex.listings[path][1]
+
+def filetype(path):
+# Type of the path looked up in the listing of its parent when it is indexed
+    loadindex()
+    parent, name = os.path.split(path)
+    if not name:
+        return 'd'
+    if parent in paramindex.listings or parent in paramindex.verified:
+        listing = entries(parent)
+        return listing.get(name) if listing is not None else None
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if S_ISDIR(stat.st_mode):
+        return 'd'
+    elif S_ISREG(stat.st_mode):
+        return 'f'
+    else:
+        return ''
+
+def isparamdir(path):
+    return filetype(path) == 'd'
+
+def isparamfile(path):
+    return filetype(path) == 'f'
+
+def assertparamdir(path):
+    kind = filetype(path)
+    if kind is None:
+        raise FileNotFoundError
+    elif kind != 'd':
+        raise NotADirectoryError
+
+def globparams(path, expr):
+    return fnmatch.filter(entries(path) or [], expr)
+
+def globpattern(component):
+    for templateclass in (ConfigTemplate, FilterGroupTemplate, InterpolationTemplate):
+        component = templateclass(component).safe_substitute(GlobDict())
+    return component
+
+def walk(trunk, componentlist, rebuild):
+# Index the directories where the components of a parameter path are globbed
+    if not componentlist:
+        return
+    pattern = globpattern(componentlist[0])
+    if pattern != componentlist[0]:
+        for branch in fnmatch.filter(entries(trunk, rebuild) or [], pattern):
+            walk(trunk/branch, componentlist[1:], rebuild)
+    elif isparamdir(trunk):
+        walk(trunk/componentlist[0], componentlist[1:], rebuild)
+
+def buildindex(parameterpaths, rebuild=False):
+    for path in parameterpaths:
+        walk(AbsPath(), AbsPath(ConfigTemplate(path).safe_substitute(names)).parts[1:], rebuild)
+    if rebuild:
+        for path in list(paramindex.listings):
+            if path not in paramindex.verified:
+                entries(path, rebuild)
+
+@lru_cache(maxsize=None)
+def contentkey(path):
+# Key of a parameter set in the node cache computed from the path, size and
+# modification time of its files, which change whenever the content does,
+# so that the shared file system is not read to hash the contents
+    digest = sha1(path.encode())
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                stat = os.stat(os.path.join(root, name))
+                digest.update(f'{os.path.relpath(os.path.join(root, name), path)}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+    else:
+        stat = os.stat(path)
+        digest.update(f'{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    return f'{os.path.basename(path)}-{digest.hexdigest()}'
@@ -0,0 +1,170 @@
+import os
+import time
+from argparse import ArgumentParser, SUPPRESS
+from clinterface import messages, _
+from .shared import names, paths, config, options, settings, script
+from .utils import ConfigTemplate
+from .fileutils import AbsPath
+from .queue import dispatchjob
+from .configuration import loadconfig
+from .tracing import span
+
+# Tasks are claimed by renaming them from pending to running with the pilot
+# job id and worker number appended after @ signs, and the claiming worker
+# touches them periodically as a lease, starting when the task is claimed
+# because the rename keeps the time the task was enqueued. Tasks with
+# expired leases are moved back to pending by any pilot, and the worker
+# that lost the lease leaves the task to its new claimant.
+
+queuedirs = ('tmp', 'pending', 'running', 'done', 'failed', 'pilots')
+
+pilotloop = r'''requeue () {
+    local lease base
+    for lease in $(find "$queue/running" -mindepth 1 -maxdepth 1 -type f ! -newermt "@$(($(date +%s) - leasetimeout))"); do
+        base=${lease##*/}
+        mv "$lease" "$queue/pending/${base%%@*}" 2> /dev/null
+    done
+}
+claim () {
+    local task
+    for task in "$queue"/pending/*; do
+        lease="$queue/running/${task##*/}@$jobid@$1"
+        if mv "$task" "$lease" 2> /dev/null; then
+            touch -c "$lease"
+            return 0
+        fi
+    done
+    return 1
+}
+worker () {
+    local idle=0 lease name status renewer
+    while (( idle < idletimeout )); do
+        requeue
+        if claim "$1"; then
+            idle=0
+            ( while [[ -f $lease ]]; do touch -c "$lease"; sleep "$renewinterval"; done ) &
+            renewer=$!
+            ( source "$lease" )
+            status=$?
+            kill $renewer
+            name=${lease##*/}
+            name=${name%%@*}
+            if [[ ! -f $lease ]]; then
+                echo "Lease of task $name was lost, it was requeued" >&2
+            elif (( status == 0 )); then
+                mv "$lease" "$queue/done/$name" 2> /dev/null
+            else
+                mv "$lease" "$queue/failed/$name" 2> /dev/null
+            fi
+        else
+            sleep "$pollinterval"
+            idle=$((idle + pollinterval))
+        fi
+    done
+}
+nproc=$((nproc/slots))
+maxram=$(($totram*$nproc/$totproc))
+for slot in $(seq "$slots"); do
+    worker "$slot" &
+done
+wait
+'''
+
+def pilotdir():
+    if 'pilotdir' in config:
+        return AbsPath(ConfigTemplate(config.pilotdir).substitute(names))
+    else:
+        return paths.home/'.clusterq'/'pilot'
+
+def makequeue():
+    queue = pilotdir()
+    for subdir in queuedirs:
+        (queue/subdir).makedirs()
+    return queue
+
+def newtaskname():
+    settings.taskcount = settings.get('taskcount', 0) + 1
+    return f'{time.time():.6f}-{os.getpid()}-{settings.taskcount}'
+
+def taskqueued(taskname):
+    queue = pilotdir()
+    if (queue/'pending'/taskname).isfile():
+        return True
+    if (queue/'running').isdir():
+        return any(i.startswith(taskname + '@') for i in (queue/'running').listdir())
+    return False
+
+def enqueue(taskname, jobname, jobdir, execdir, imports, exports):
+    (jobdir/'exit').remove()
+    jobscript = jobdir/'script'
+    with span('script'), open(jobscript, 'w') as f:
+        f.write(script.skeleton.pilottask(jobname, execdir, imports, exports, jobdir))
+    if options.debug.dry_run:
+        messages.success(_('Se procesó el trabajo "$jobname" y se generaron los archivos para el envío en el directorio $jobdir', jobname=jobname, jobdir=jobdir))
+        return
+    queue = makequeue()
+    jobscript.copyas(queue/'tmp'/taskname)
+    os.rename(queue/'tmp'/taskname, queue/'pending'/taskname)
+    with open(jobdir/'task', 'w') as f:
+        f.write(taskname)
+    messages.success(_('El trabajo "$jobname" se agregó a la cola de los pilotos de $clustername', jobname=jobname, clustername=names.cluster))
+
+def clusterq_pilot(arglist):
+
+    parser = ArgumentParser(prog='clusterq pilot', description='Envía trabajos piloto que ejecutan los trabajos encolados con la opción --pilot.')
+    parser.add_argument('-c', '--count', type=int, metavar='#PILOTS', default=1, help='Enviar #PILOTS trabajos piloto.')
+    parser.add_argument('-n', '--nproc', type=int, metavar='#PROCS', default=1, help='Requerir #PROCS núcleos de procesamiento para cada piloto.')
+    parser.add_argument('-s', '--slots', type=int, metavar='#SLOTS', default=1, help='Correr hasta #SLOTS trabajos simultáneos en cada piloto repartiendo los núcleos entre ellos.')
+    parser.add_argument('-q', '--queue', metavar='QUEUE', default=SUPPRESS, help='Requerir la cola QUEUE.')
+    parser.add_argument('--cfgdir', metavar='PATH', default=os.environ.get('CLUSTERQCFG'), help='Usar la configuración del directorio PATH.')
+    parser.add_argument('--dry-run', action='store_true', help='Generar los scripts de los pilotos sin enviarlos.')
+    args = parser.parse_args(arglist)
+
+    loadconfig(args.cfgdir)
+
+    if args.count < 1 or args.nproc < 1 or args.slots < 1:
+        messages.error(_('El número de pilotos, núcleos y trabajos simultáneos debe ser positivo'))
+
+    if args.nproc % args.slots:
+        messages.error(_('El número de núcleos debe ser múltiplo del número de trabajos simultáneos'))
+
+    queue = makequeue()
+    pilot = config.get('pilot', {})
+
+    meta = []
+    if 'jobtype' in config:
+        meta.append(ConfigTemplate(config.jobtype).substitute(jobtype='pilot'))
+    if 'queue' in args:
+        meta.append(ConfigTemplate(config.queue).substitute(queue=args.queue))
+    elif 'queue' in config.defaults:
+        meta.append(ConfigTemplate(config.queue).substitute(queue=config.defaults.queue))
+    for item in config.singlehost:
+        meta.append(ConfigTemplate(item).substitute(nproc=args.nproc, nhost=1))
+    for path in config.logfiles:
+        meta.append(ConfigTemplate(path).safe_substitute(logdir=AbsPath(ConfigTemplate(config.logdir).substitute(names))))
+    meta.append(ConfigTemplate(config.jobname).substitute(jobname='pilot'))
+
+    lines = ['#!/bin/bash -x'] + meta + ['shopt -s extglob nullglob']
+    lines.extend(f'{key}="{value}"' for key, value in config.envars.items())
+    lines.append("totram=$(free | awk 'NR==2{print $2}')")
+    lines.append("totproc=$(getconf _NPROCESSORS_ONLN)")
+    lines.append(f'queue="{queue}"')
+    lines.append(f'slots={args.slots}')
+    lines.append(f"leasetimeout={pilot.get('leasetimeout', 600)}")
+    lines.append(f"renewinterval={pilot.get('renewinterval', 60)}")
+    lines.append(f"idletimeout={pilot.get('idletimeout', 600)}")
+    lines.append(f"pollinterval={pilot.get('pollinterval', 30)}")
+
+    for i in range(1, args.count + 1):
+        jobscript = queue/'pilots'/f"{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{i}"
+        with open(jobscript, 'w') as f:
+            f.write(''.join(line + '\n' for line in lines) + pilotloop)
+        if args.dry_run:
+            messages.success(_('Se generó el script del piloto $jobscript', jobscript=jobscript))
+            continue
+        try:
+            jobid = dispatchjob(jobscript)
+        except RuntimeError as error:
+            messages.failure(_('El gestor de trabajos reportó el siguiente error al enviar el piloto: $error', error=error))
+        else:
+            messages.success(_('El piloto se correrá en $nproc núcleo(s) en $clustername con el número $jobid', nproc=args.nproc, clustername=names.cluster, jobid=jobid))
@@ -1,39 +1,438 @@
 import os
 import re
 import sys
+import json
+import time
+import fcntl
+import shlex
+import random
+import threading
+from math import ceil
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse import urlsplit
 from subprocess import Popen, PIPE
-from .shared import config
+from clinterface import messages, _
+from .shared import config, names, paths
+from .utils import ConfigTemplate
+from .fileutils import AbsPath
+from .tracing import span, traced
+from .localqueue import LocalBackend
+from .history import parsewalltime, parsememory, parseduration, parsesize
 
+backends = {}
+
+class CLIBackend:
+# Submit and query jobs running the commands of the scheduler
+    def submit(self, jobscript):
+        with open(jobscript, 'r') as fh:
+            process = Popen(config.sbmtcmd, stdin=fh, stdout=PIPE, stderr=PIPE, close_fds=True)
+        output, error = process.communicate()
+        output = output.decode(sys.stdout.encoding).strip()
+        error = error.decode(sys.stdout.encoding).strip()
+        if process.returncode == 0:
+            return re.fullmatch(config.sbmtregex, output).group(1)
+        else:
+            raise RuntimeError(error)
+    def status(self, jobid):
+        process = Popen(config.statcmd + [jobid], stdout=PIPE, stderr=PIPE, close_fds=True)
+        output, error = process.communicate()
+        output = output.decode(sys.stdout.encoding).strip()
+        error = error.decode(sys.stdout.encoding).strip()
+        if process.returncode == 0:
+            if not output:
+                return None
+            match = re.fullmatch(config.statregex, output)
+            if match is None:
+                raise LookupError(output)
+            return match.group(1)
+        else:
+            for regex in config.ignorederrors:
+                if re.fullmatch(regex, error):
+                    return None
+            raise RuntimeError(error)
+    def cancel(self, jobid):
+        if not 'cnclcmd' in config:
+            messages.error(_('No se especificó el comando para cancelar trabajos'), 'config.cnclcmd')
+        process = Popen(config.cnclcmd + [jobid], stdout=PIPE, stderr=PIPE, close_fds=True)
+        output, error = process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(error.decode(sys.stdout.encoding).strip())
+
+class SlurmRESTBackend:
+# Submit and query jobs through the REST API of Slurm (slurmrestd) reusing
+# a single keep-alive connection. The status of all the jobs is fetched with
+# one request and reused for config.restcache seconds
+    sbatchoptions = {
+        '-J': 'name', '--job-name': 'name',
+        '-p': 'partition', '--partition': 'partition',
+        '-n': 'tasks', '--ntasks': 'tasks',
+        '-N': 'nodes', '--nodes': 'nodes',
+        '-w': 'required_nodes', '--nodelist': 'required_nodes',
+        '-o': 'standard_output', '--output': 'standard_output',
+        '-e': 'standard_error', '--error': 'standard_error',
+        '-t': 'time_limit', '--time': 'time_limit',
+        '--mem': 'memory_per_node',
+        '--comment': 'comment',
+        '--dependency': 'dependency',
+        '--signal': 'kill_warning_signal',
+    }
+    def __init__(self, url, version, token, cachetime):
+        url = urlsplit(url)
+        self.https = url.scheme == 'https'
+        self.netloc = url.netloc
+        self.prefix = url.path.rstrip('/') + f'/slurm/{version}'
+        self.headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'Connection': 'keep-alive',
+            'X-SLURM-USER-NAME': names.user,
+            'X-SLURM-USER-TOKEN': token,
+        }
+        self.cachetime = cachetime
+        self.connection = None
+        self.snapshot = None
+        self.snapshottime = 0
+    def connect(self):
+        if self.https:
+            self.connection = HTTPSConnection(self.netloc, timeout=60)
+        else:
+            self.connection = HTTPConnection(self.netloc, timeout=60)
+    def request(self, method, path, body=None, missing=False):
+        # Reconnect once if the server closed the idle connection
+        for attempt in (1, 2):
+            if self.connection is None:
+                self.connect()
+            try:
+                self.connection.request(method, self.prefix + path, body=body and json.dumps(body), headers=self.headers)
+                response = self.connection.getresponse()
+                data = response.read()
+            except (HTTPException, ConnectionError) as e:
+                self.connection.close()
+                self.connection = None
+                if attempt == 2:
+                    raise RuntimeError(str(e))
+            except OSError as e:
+                self.connection.close()
+                self.connection = None
+                raise RuntimeError(str(e))
+            else:
+                break
+        if response.getheader('Connection', '').lower() == 'close':
+            self.connection.close()
+            self.connection = None
+        try:
+            reply = json.loads(data) if data else {}
+        except ValueError:
+            raise RuntimeError(f'HTTP {response.status}: {data.decode(errors="replace")}')
+        # Slurm reports unknown jobs with the error ESLURM_INVALID_JOB_ID
+        if missing and (response.status == 404 or any(e.get('error_number') == 2017 for e in reply.get('errors', []))):
+            return None
+        errors = [e.get('description') or e.get('error') or str(e) for e in reply.get('errors', [])]
+        if response.status >= 400 or errors:
+            raise RuntimeError('\n'.join(errors) or f'HTTP {response.status} {response.reason}')
+        return reply
+    def jobdescription(self, jobscript):
+        # Translate the sbatch directives of the script because the
+        # REST API takes the job properties separately
+        job = dict(
+            current_working_directory = os.getcwd(),
+            environment = [f'{key}={value}' for key, value in os.environ.items()],
+        )
+        for line in jobscript.splitlines():
+            if line.startswith('#SBATCH'):
+                args = shlex.split(line[len('#SBATCH'):])
+                for i, arg in enumerate(args):
+                    option, sep, value = arg.partition('=')
+                    if not sep and i + 1 < len(args):
+                        value = args[i + 1]
+                    if option in self.sbatchoptions:
+                        key = self.sbatchoptions[option]
+                        if key in ('tasks', 'nodes'):
+                            job[key] = int(value)
+                        elif key == 'required_nodes':
+                            job[key] = value.split(',')
+                        elif key == 'time_limit':
+                            job[key] = ceil(parsewalltime(value)/60)
+                        elif key == 'memory_per_node':
+                            job[key] = parsememory(value)
+                        elif key == 'kill_warning_signal':
+                            # The signal is given as [R:|B:]SIG[@SECONDS] and
+                            # sent 60 seconds before the time limit by default
+                            flags, colon, value = value.rpartition(':')
+                            signal, at, delay = value.partition('@')
+                            job[key] = signal
+                            job['kill_warning_delay'] = int(delay or 60)
+                            if 'B' in flags:
+                                job['kill_warning_flags'] = ['BATCH_JOB']
+                        else:
+                            job[key] = value
+            elif line and not line.startswith('#'):
+                break
+        return job
+    def submit(self, jobscript):
+        with open(jobscript, 'r') as fh:
+            script = fh.read()
+        reply = self.request('POST', '/job/submit', dict(script=script, job=self.jobdescription(script)))
+        self.snapshot = None
+        return str(reply['job_id'])
+    def update(self, jobs):
+        for job in jobs:
+            state = job['job_state']
+            # Newer API versions report a list of state flags
+            if isinstance(state, list):
+                state = state[0] if state else None
+            self.snapshot[str(job['job_id'])] = state
+    def refresh(self):
+        if self.snapshot is None or time.time() - self.snapshottime > self.cachetime:
+            self.snapshot = {}
+            self.update(self.request('GET', '/jobs')['jobs'])
+            self.snapshottime = time.time()
+    def status(self, jobid):
+        self.refresh()
+        # Jobs submitted after the snapshot was taken are queried one by
+        # one, because a missing job is taken as finished
+        if jobid not in self.snapshot:
+            reply = self.request('GET', f'/job/{jobid}', missing=True)
+            self.snapshot[jobid] = None
+            if reply is not None:
+                self.update(reply.get('jobs', []))
+        return self.snapshot[jobid]
+    def cancel(self, jobid):
+        self.request('DELETE', f'/job/{jobid}')
+        self.snapshot = None
+
+def getbackend():
+# The backend is created on first use, once the configuration is loaded,
+# for each scheduler configuration and thread, because the REST backend
+# keeps its connection open
+    name = config.get('backend', 'cli')
+    key = (name, config.get('resturl'), config.get('localdir'), names.cluster, threading.get_ident())
+    if key not in backends:
+        if name == 'cli':
+            backends[key] = CLIBackend()
+        elif name == 'slurmrest':
+            if not 'resturl' in config:
+                messages.error(_('No se especificó la URL del servidor REST del gestor de trabajos'), 'config.resturl')
+            try:
+                token = os.environ['SLURM_JWT']
+            except KeyError:
+                messages.error(_('No se encontró el token de autenticación del servidor REST'), 'SLURM_JWT')
+            try:
+                cachetime = float(config.get('restcache', 5))
+            except ValueError:
+                messages.error(_('Se esperaba un valor numérico'), f'restcache={config.restcache}')
+            backends[key] = SlurmRESTBackend(config.resturl, config.get('restversion', 'v0.0.39'), token, cachetime)
+        elif name == 'local':
+            if 'localdir' in config:
+                queuedir = AbsPath(ConfigTemplate(config.localdir).substitute(names))
+            else:
+                queuedir = paths.home/'.clusterq'/'local'
+            try:
+                slots = int(config.get('localslots', os.cpu_count()))
+            except ValueError:
+                messages.error(_('Se esperaba un valor numérico'), f'localslots={config.localslots}')
+            backends[key] = LocalBackend(queuedir, slots)
+        else:
+            messages.error(_('El tipo de gestor de trabajos no es válido'), f'config.backend={name}')
+    return backends[key]
+
+@traced('submitjob')
 def submitjob(jobscript):
-    with open(jobscript, 'r') as fh:
-        process = Popen(config.sbmtcmd, stdin=fh, stdout=PIPE, stderr=PIPE, close_fds=True)
-    output, error = process.communicate()
-    output = output.decode(sys.stdout.encoding).strip()
-    error = error.decode(sys.stdout.encoding).strip()
-    if process.returncode == 0:
-        return re.fullmatch(config.sbmtregex, output).group(1)
+    return getbackend().submit(jobscript)
+
+def jobstatus(state):
+    if state is None or state in config.finished_states:
+        return True, None
+    elif state in config.running_states:
+        return False, 'El trabajo "$name" no se envió porque hay otro trabajo corriendo usando el directorio $path'
     else:
-        raise RuntimeError(error)
-        
+        return False, f'El trabajo "$name" no se envió porque tiene un código de estado desconocido: {state}'
+
+@traced('jobstatus')
 def getjobstatus(jobid):
-    process = Popen(config.statcmd + [jobid], stdout=PIPE, stderr=PIPE, close_fds=True)
+    try:
+        state = getbackend().status(jobid)
+    except LookupError as e:
+        return False, f'El trabajo "$name" no se envió porque no se pudo determinar su estado:\n{e}'
+    except RuntimeError as e:
+        return False, f'El trabajo "$name" no se envió porque ocurrió un error al consultar su estado:\n{e}'
+    return jobstatus(state)
+
+@traced('accounting')
+def getaccounting(jobids):
+# Query the accounting records of many jobs with a single command for each
+# chunk of config.acctchunk jobs, merging the records of the job steps
+    if not 'acctcmd' in config:
+        messages.error(_('No se especificó el comando de contabilidad del gestor de trabajos'), 'config.acctcmd')
+    records = {}
+    chunk = int(config.get('acctchunk', 500))
+    for i in range(0, len(jobids), chunk):
+        if 'acctsep' in config:
+            arglist = config.acctcmd + [config.acctsep.join(jobids[i:i+chunk])]
+        else:
+            arglist = config.acctcmd + jobids[i:i+chunk]
+        process = Popen(arglist, stdout=PIPE, stderr=PIPE, close_fds=True)
+        output, error = process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(error.decode(sys.stdout.encoding).strip())
+        for match in re.finditer(config.acctregex, output.decode(sys.stdout.encoding), re.MULTILINE):
+            fields = match.groupdict()
+            record = records.setdefault(fields['jobid'], {})
+            for key, parser in (('state', str), ('exitcode', int), ('elapsed', parseduration), ('cputime', parseduration), ('maxrss', parsesize)):
+                try:
+                    value = parser(fields[key]) if fields.get(key) else None
+                except ValueError:
+                    value = None
+                if value is None:
+                    continue
+                # Jobs killed by a signal are reported as the shell does
+                if key == 'exitcode' and fields.get('signal') and int(fields['signal']):
+                    value = 128 + int(fields['signal'])
+                if key == 'maxrss':
+                    record[key] = max(value, record.get(key, 0))
+                elif key not in record:
+                    record[key] = value
+    return records
+
+def querylines(arglist, regex):
+    process = Popen(arglist, stdout=PIPE, stderr=PIPE, close_fds=True)
     output, error = process.communicate()
-    output = output.decode(sys.stdout.encoding).strip()
-    error = error.decode(sys.stdout.encoding).strip()
-    if process.returncode == 0:
-        if not output:
-            return True, None
-        match = re.fullmatch(config.statregex, output)
-        if match is None:
-            return False, f'El trabajo "$name" no se envió porque no se pudo determinar su estado:\n{output}'
-        if match.group(1) in config.finished_states:
-            return True, None
-        elif match.group(1) in config.running_states:
-            return False, 'El trabajo "$name" no se envió porque hay otro trabajo corriendo usando el directorio $path'
+    if process.returncode != 0:
+        raise RuntimeError(error.decode(sys.stdout.encoding).strip())
+    return [match.groupdict() for match in re.finditer(regex, output.decode(sys.stdout.encoding), re.MULTILINE)]
+
+def count(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+@traced('partitions')
+def getpartitions():
+# Idle and total cores, pending cores and time limit of each queue, taken
+# with one command for all the queues (and another one for the pending
+# jobs when the first does not report them)
+    partitions = {}
+    for fields in querylines(config.partcmd, config.partregex):
+        total = count(fields.get('total'))
+        idle = count(fields.get('idle'))
+        if idle is None and total is not None and count(fields.get('used')) is not None:
+            idle = total - count(fields['used'])
+        maxtime = fields.get('maxtime')
+        # Queues split in several lines (one per node state) are added up
+        partition = partitions.setdefault(fields['queue'], dict(idle=0, total=0, pending=0, maxtime=None))
+        partition['idle'] += idle or 0
+        partition['total'] += total or 0
+        partition['pending'] += count(fields.get('pending')) or 0
+        if maxtime and maxtime[0].isdigit():
+            partition['maxtime'] = parseduration(maxtime)
+    if 'pendcmd' in config:
+        for fields in querylines(config.pendcmd, config.pendregex):
+            if fields['queue'] in partitions:
+                partitions[fields['queue']]['pending'] += count(fields.get('cores')) or 1
+    return partitions
+
+def selectqueue(nproc, walltime):
+# Queue with the shortest expected start among the eligible queues whose
+# time limit allows the job: queues with enough idle cores start it at
+# once, otherwise it waits behind the pending cores relative to the size
+# of the queue
+    if not 'partcmd' in config:
+        messages.error(_('El gestor de trabajos no admite seleccionar la cola automáticamente'), 'config.partcmd')
+    try:
+        partitions = getpartitions()
+    except RuntimeError as error:
+        messages.error(_('El gestor de trabajos reportó el siguiente error al consultar las colas: $error', error=error))
+    eligible = config.get('autoqueues') or list(partitions)
+    candidates = []
+    for queue in eligible:
+        if queue not in partitions:
+            continue
+        partition = partitions[queue]
+        if walltime is not None and partition['maxtime'] is not None and partition['maxtime'] < walltime:
+            continue
+        if partition['idle'] >= nproc:
+            wait = 0
         else:
-            return False, f'El trabajo "$name" no se envió porque tiene un código de estado desconocido: {match.group(1)}'
-    else:
-        for regex in config.ignorederrors:
-            if re.fullmatch(regex, error):
-                return True, None
-        return False, f'El trabajo "$name" no se envió porque ocurrió un error al consultar su estado:\n{error}'
+            wait = (partition['pending'] + nproc - partition['idle'])/max(partition['total'], 1)
+        candidates.append((wait, partition['pending'], -partition['idle'], queue))
+    if not candidates:
+        messages.error(_('Ninguna de las colas $queues admite el trabajo', queues=', '.join(eligible)))
+    return min(candidates)[-1]
+
+def canceljob(jobid):
+    getbackend().cancel(jobid)
+
+class Admission:
+# Space the submissions of all the clusterq processes of the user with a
+# state file locked while it is updated. Each submission reserves the next
+# free slot, and the delay between slots shrinks by a fixed step after
+# each fast submission and doubles after a slow or failed one, never going
+# below config.delay or above the maximum delay
+    def __init__(self):
+        admission = config.get('admission', {})
+        try:
+            self.mindelay = float(config.get('delay', 0))
+            self.maxdelay = float(admission.get('maxdelay', 60))
+            self.step = float(admission.get('step', 0.5))
+            self.latency = float(admission.get('latency', 5))
+            self.retries = int(admission.get('retries', 5))
+            self.backoff = float(admission.get('backoff', 2))
+        except ValueError:
+            messages.error(_('Se esperaba un valor numérico'), 'config.admission')
+    def update(self, change):
+        with open(paths.lock, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                state = json.loads(f.read())
+                state = dict(delay=float(state['delay']), next=float(state['next']))
+            except (ValueError, TypeError, KeyError):
+                state = dict(delay=self.mindelay, next=0)
+            result = change(state)
+            state['delay'] = min(self.maxdelay, max(self.mindelay, state['delay']))
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+        return result
+    def reserve(self):
+# Time to wait until the reserved slot
+        def change(state):
+            start = max(time.time(), state['next'])
+            state['next'] = start + state['delay']
+            return start - time.time()
+        return self.update(change)
+    def record(self, latency, failed):
+        def change(state):
+            if failed or latency > self.latency:
+                state['delay'] = max(2*state['delay'], 1)
+            else:
+                state['delay'] -= self.step
+        self.update(change)
+    def transient(self, error):
+        return any(re.search(regex, error) for regex in config.transienterrors)
+    def submit(self, jobscript):
+        attempt = 0
+        while True:
+            delay = self.reserve()
+            if delay > 0:
+                with span('delay'):
+                    time.sleep(delay)
+            start = time.time()
+            try:
+                jobid = submitjob(jobscript)
+            except RuntimeError as error:
+                self.record(time.time() - start, True)
+                if attempt >= self.retries or not self.transient(str(error)):
+                    raise
+                # Full jitter so that the processes that failed together do
+                # not retry together
+                attempt += 1
+                with span('backoff'):
+                    time.sleep(random.uniform(0, min(self.maxdelay, self.backoff*2**attempt)))
+            else:
+                self.record(time.time() - start, False)
+                return jobid
+
+def dispatchjob(jobscript):
+    return Admission().submit(jobscript)
@@ -1,4 +1,5 @@
 from clinterface import messages, _
+from .tracing import traced
 #from logging import WARNING
 
 class ParseError(Exception):
@@ -22,6 +23,7 @@ def molblock(coords, progspecfile):
     else:
        messages.error(_('Formato desconocido'), f'molformat={molformat}')
 
+@traced('readmol')
 def readmol(molfile):
 # Guess format and read molfile
     if molfile.isfile():
@@ -0,0 +1,73 @@
+import os
+import time
+from argparse import ArgumentParser
+from clinterface import messages, _
+from .shared import names, config
+from .history import database
+from .queue import getaccounting
+from .configuration import loadconfig
+
+groupings = ('program', 'version', 'queue', 'user')
+
+def harvestaccounting():
+# Jobs are queried until the scheduler reports them in a finished state
+    db = database()
+    final = list(config.finished_states)
+    jobids = [row[0] for row in db.execute(f"select jobid from jobs where cluster = ? and (state is null or state not in ({','.join('?'*len(final))}))", [names.cluster] + final)]
+    if not jobids:
+        return 0
+    try:
+        records = getaccounting(jobids)
+    except RuntimeError as error:
+        messages.error(_('El gestor de trabajos reportó el siguiente error al consultar la contabilidad: $error', error=error))
+    # The exit code of jobs that did not finish is not known yet
+    with db:
+        db.executemany('update jobs set state = coalesce(?, state), exitcode = coalesce(?, exitcode), elapsed = coalesce(?, elapsed), cputime = coalesce(?, cputime), maxrss = coalesce(max(?, maxrss), ?, maxrss) where cluster = ? and jobid = ?', [
+            (record.get('state'), record.get('exitcode') if record.get('state') in final else None, record.get('elapsed'), record.get('cputime'), record.get('maxrss'), record.get('maxrss'), names.cluster, jobid)
+            for jobid, record in records.items()
+        ])
+    return len(records)
+
+def clusterq_report(arglist):
+
+    parser = ArgumentParser(prog='clusterq report', description='Resume la eficiencia de los trabajos enviados con ClusterQ a partir de la contabilidad del gestor de trabajos.')
+    parser.add_argument('-g', '--group-by', metavar='FIELD', nargs='+', choices=groupings, default=['program', 'version'], help='Agrupar los trabajos por estos campos ({}).'.format(', '.join(groupings)))
+    parser.add_argument('-d', '--days', type=float, metavar='DAYS', default=None, help='Incluir sólo los trabajos enviados en los últimos DAYS días.')
+    parser.add_argument('--no-update', action='store_true', help='No consultar la contabilidad del gestor de trabajos.')
+    parser.add_argument('--cfgdir', metavar='PATH', default=os.environ.get('CLUSTERQCFG'), help='Usar la configuración del directorio PATH.')
+    args = parser.parse_args(arglist)
+
+    loadconfig(args.cfgdir)
+
+    if not args.no_update:
+        harvestaccounting()
+
+    # The elapsed time written by the job script is used when the
+    # scheduler does not report it
+    fields = ', '.join(args.group_by)
+    query = f'''select {fields}, count(*),
+        sum(cputime), sum(coalesce(elapsed, finished - started)*nproc),
+        sum(case when memory and maxrss then memory*1024.0/maxrss end), count(case when memory and maxrss then 1 end),
+        sum(case when walltime and coalesce(elapsed, finished - started) then walltime/coalesce(elapsed, finished - started) end), count(case when walltime and coalesce(elapsed, finished - started) then 1 end)
+        from jobs where cluster = ? and submitted >= ? group by {fields} order by {fields}'''
+    since = time.time() - args.days*86400 if args.days is not None else 0
+    rows = database().execute(query, (names.cluster, since)).fetchall()
+
+    if not rows:
+        messages.warning(_('No hay trabajos registrados en $clustername', clustername=names.cluster))
+        return
+
+    headers = list(args.group_by) + [_('trabajos'), _('eficiencia CPU'), _('memoria pedida/usada'), _('tiempo pedido/usado')]
+    table = []
+    for row in rows:
+        groups = row[:len(args.group_by)]
+        count, cputime, coretime, memratio, memcount, timeratio, timecount = row[len(args.group_by):]
+        table.append([str(i) for i in groups] + [
+            str(count),
+            f'{100*cputime/coretime:.1f}%' if cputime and coretime else '-',
+            f'{memratio/memcount:.2f}' if memcount else '-',
+            f'{timeratio/timecount:.2f}' if timecount else '-',
+        ])
+    widths = [max(len(line[i]) for line in [headers] + table) for i in range(len(headers))]
+    for line in [headers] + table:
+        print('  '.join(cell.ljust(width) for cell, width in zip(line, widths)))
@@ -0,0 +1,56 @@
+import os
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor
+from clinterface import messages, _
+from .shared import config, status
+from .initialization import initialize
+from .submission import makejobname, outputdir
+from .tracing import span
+
+# Bytes read from the end of an output file to look for the success marker
+tailsize = 16384
+scanthreads = 32
+
+def tailcontains(path, text):
+    try:
+        with open(path, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - tailsize))
+            return text.encode() in f.read()
+    except (FileNotFoundError, NotADirectoryError):
+        return False
+
+def exitstatus(jobdir):
+# Exit status recorded in the stats file by the job script
+    try:
+        with open(jobdir/'stats', 'r') as f:
+            return f.read().split()[2]
+    except (FileNotFoundError, NotADirectoryError, IndexError):
+        return None
+
+def completed(target):
+# The job completed if its output ends with the success marker of the
+# program, or if it exited successfully when the program has no marker
+    outdir, jobname = target
+    if 'successmarker' in config:
+        return tailcontains(outdir/jobname*config.successmarker.file, config.successmarker.text)
+    else:
+        return exitstatus(outdir/'.job') == '0'
+
+def scanjobs(arguments, steps):
+# Check the output directories of all the jobs in parallel, because each
+# check is dominated by the latency of the shared file system
+    if not status.initialized:
+        initialize()
+    targets = []
+    for workdir, inputname, filtergroups in arguments:
+        for step in steps:
+            jobname = makejobname(inputname, step)
+            targets.append((outputdir(workdir, jobname), jobname))
+    # The workers run in copies of the context of the session
+    context = copy_context()
+    with span('scan'), ThreadPoolExecutor(max_workers=scanthreads) as executor:
+        done = {outdir/jobname for (outdir, jobname), ok in zip(targets, executor.map(lambda target: context.copy().run(completed, target), targets)) if ok}
+    if done:
+        messages.success(_('Se omitirán $count de $total trabajos que ya terminaron correctamente', count=len(done), total=len(targets)))
+    return done
@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import time
+from math import ceil
+from argparse import ArgumentParser
+from subprocess import call
+from clinterface import messages, _
+from .shared import names, paths, config, options, settings
+from .fileutils import AbsPath
+from .history import database
+from .report import harvestaccounting
+from .configuration import loadconfig
+
+# Jobs that ended in one of these states are resubmitted with the
+# resources escalated by the listed actions, "restart" restarts the job
+# from the checkpoint files left in the output directory
+defaultpolicy = {
+    'TIMEOUT': ['walltime', 'restart'],
+    'OUT_OF_MEMORY': ['memory'],
+    'NODE_FAIL': ['restart'],
+    'PREEMPTED': ['restart'],
+}
+
+# Options that are not replayed because they ask or answer questions
+interactive = {'-p', '--prompt', '--yes', '--no', '--resume', '--retry-of'}
+
+def replayargs(parser, argv):
+# Options of the command line without the input files, which are told apart
+# by their position because an option value may be equal to a file name
+    actions = parser._option_string_actions
+    arglist = []
+    args = iter(argv)
+    for arg in args:
+        if arg == '--':
+            break
+        if not arg.startswith('-') or arg == '-':
+            continue
+        option, sep, value = arg.partition('=')
+        if option not in actions:
+            if option.startswith('--'):
+                matches = [key for key in actions if key.startswith(option)]
+                if len(matches) == 1:
+                    option = matches[0]
+            elif option[:2] in actions:
+                option, sep = option[:2], True
+        action = actions.get(option)
+        value = next(args, None) if action is not None and action.nargs != 0 and not sep else None
+        if option not in interactive:
+            arglist.append(arg)
+            if value is not None:
+                arglist.append(value)
+    return arglist
+
+def replaycommand(workdir, inputname):
+# Command line that submits the job again on its own, jobs that are part of
+# a workflow, a bundle or a pilot queue are not replayed
+    if 'workflow' in options.common or 'bundle' in options.common or options.common.pilot:
+        return None
+    return json.dumps(dict(
+        cwd = os.getcwd(),
+        args = [names.command] + settings.arglist + ['--cwd', workdir, '--job', inputname],
+        restart = list(config.restartfiles.values()),
+    ))
+
+def dropoption(arglist, short, long):
+    args = iter(arglist)
+    return [arg for arg in args if not (arg in (short, long) and next(args, None) or arg.startswith(long + '='))]
+
+def checkpoint(outdir, jobname, outkeys):
+# Link the restart files of the job out of the way of the new attempt,
+# which removes the old output files before it starts
+    found = [key for key in outkeys if (outdir/jobname*key).isfile()]
+    if not found:
+        return None
+    restartdir = outdir/'.job'/'checkpoint'/jobname
+    restartdir.makedirs()
+    for key in found:
+        (restartdir/jobname*key).remove()
+        try:
+            os.link(outdir/jobname*key, restartdir/jobname*key)
+        except OSError:
+            (outdir/jobname*key).copyas(restartdir/jobname*key)
+    return restartdir
+
+def retryjobs(dryrun=False):
+# Resubmit the failed jobs that are due, it is safe to run it repeatedly,
+# for example from cron, because only the last attempt in each output
+# directory is considered, so that jobs resubmitted by hand or by an
+# earlier run are not retried
+
+    retry = config.get('retry', {})
+    policy = dict(defaultpolicy, **retry.get('policy', {}))
+    maxattempts = retry.get('maxattempts', 3)
+    backoff = retry.get('backoff', 300)
+
+    harvestaccounting()
+
+    db = database()
+    rows = db.execute(f'''select jobid, jobname, outdir, state, nproc, walltime, memory, maxrss, coalesce(elapsed, finished - started), coalesce(finished, submitted + elapsed, submitted), command, coalesce(attempt, 1)
+        from jobs as j where cluster = ? and user = ? and command is not null and state in ({','.join('?'*len(policy))})
+        and not exists (select 1 from jobs as k where k.cluster = j.cluster and k.outdir = j.outdir and k.jobname = j.jobname and k.submitted > j.submitted)
+        order by submitted''', [names.cluster, names.user] + list(policy)).fetchall()
+
+    if not rows:
+        messages.success(_('No hay trabajos que reenviar'))
+        return
+
+    for jobid, jobname, outdir, state, nproc, walltime, memory, maxrss, elapsed, failed, command, attempt in rows:
+        if attempt >= maxattempts:
+            messages.warning(_('El trabajo "$jobname" ($jobid) no se reenviará porque alcanzó el máximo de $count intentos', jobname=jobname, jobid=jobid, count=maxattempts))
+            continue
+        # The delay doubles with each attempt
+        delay = backoff*2**(attempt - 1)
+        if time.time() < failed + delay:
+            messages.warning(_('El trabajo "$jobname" ($jobid) se reenviará después de $minutes minutos', jobname=jobname, jobid=jobid, minutes=ceil((failed + delay - time.time())/60)))
+            continue
+        command = json.loads(command)
+        outdir = AbsPath(outdir)
+        arglist = command['args']
+        changes = []
+        unknown = []
+        for action in policy[state]:
+            if action == 'walltime':
+                if walltime or elapsed:
+                    walltime = ceil(retry.get('walltimefactor', 2)*(walltime or elapsed)/60)
+                    arglist = arglist + ['--walltime', str(walltime)]
+                    changes.append(f'walltime={walltime}')
+                else:
+                    unknown.append(_('tiempo de ejecución'))
+            elif action == 'memory':
+                if memory or maxrss:
+                    memory = ceil(retry.get('memoryfactor', 1.5)*(memory or maxrss/1024))
+                    arglist = arglist + ['--mem', f'{memory}M']
+                    changes.append(f'mem={memory}M')
+                else:
+                    unknown.append(_('memoria'))
+            elif action == 'nproc':
+                if nproc:
+                    nproc = ceil(retry.get('nprocfactor', 2)*nproc)
+                    arglist = arglist + ['--nproc', str(nproc)]
+                    changes.append(f'nproc={nproc}')
+                else:
+                    unknown.append(_('número de núcleos'))
+        # The job would fail again with the same resources
+        if unknown:
+            messages.warning(_('El trabajo "$jobname" ($jobid) no se reenviará porque no se conoce su $resource para aumentarlo', jobname=jobname, jobid=jobid, resource=unknown[0]))
+            continue
+        if 'restart' in policy[state] and command['restart'] and not dryrun:
+            restartdir = checkpoint(outdir, jobname, command['restart'])
+            if restartdir:
+                arglist = dropoption(arglist, '-r', '--restart') + ['--restart', restartdir]
+                changes.append(f'restart={restartdir}')
+        messages.success(_('Reenviando el trabajo "$jobname" ($jobid) que terminó con el estado $state, intento $attempt de $count: $changes', jobname=jobname, jobid=jobid, state=state, attempt=attempt + 1, count=maxattempts, changes=' '.join(changes) or '-'))
+        if dryrun:
+            continue
+        environ = dict(os.environ, CLUSTERQCFG=paths.cfgdir)
+        call([sys.executable, '-m', 'clusterq.main'] + arglist + ['--yes', '--retry-of', jobid], cwd=command['cwd'], env=environ)
+
+def clusterq_retry(arglist):
+
+    parser = ArgumentParser(prog='clusterq retry', description='Reenvía con más recursos los trabajos que terminaron por falta de tiempo o memoria o por una falla del nodo. Los trabajos también se reenvían con clusterq status si se activa retry.auto en la configuración.')
+    parser.add_argument('--dry-run', action='store_true', help='Mostrar los trabajos que se reenviarían sin reenviarlos.')
+    parser.add_argument('--cfgdir', metavar='PATH', default=os.environ.get('CLUSTERQCFG'), help='Usar la configuración del directorio PATH.')
+    args = parser.parse_args(arglist)
+
+    loadconfig(args.cfgdir)
+
+    retryjobs(args.dry_run)
@@ -0,0 +1,76 @@
+import os
+import threading
+from contextlib import contextmanager
+from .shared import current, newstate, names, options, settings
+from .fileutils import AbsPath
+from .configuration import loadconfig
+from .main import makeparser, setoptions, submitall
+from .queue import getbackend
+from .tracing import tracer
+
+class Session:
+# Configuration and state of clusterq for submitting jobs from Python.
+# Sessions are independent of each other and of the command line, so that
+# several of them can run concurrently in different threads, while the
+# calls to the same session are serialized. The options are given as
+# keyword arguments named after the long options of the command line,
+# for example Session('g16', nproc=4, queue='auto', restart=[path])
+    def __init__(self, command, cfgdir=None, **kwargs):
+        self.state = newstate()
+        self.lock = threading.RLock()
+        with self.activate():
+            tracer.discard()
+            names.command = command
+            loadconfig(cfgdir or os.environ.get('CLUSTERQCFG'), command)
+            arglist = []
+            for key, value in kwargs.items():
+                flag = '--' + key.replace('_', '-')
+                if value is True:
+                    arglist.append(flag)
+                elif isinstance(value, (list, tuple)):
+                    for item in value:
+                        arglist.extend([flag, str(item)])
+                elif value is not None and value is not False:
+                    arglist.extend([flag, str(value)])
+            setoptions(makeparser(), arglist)
+            settings.arglist = arglist
+    @contextmanager
+    def activate(self):
+# Make the state of the session current in this thread for the duration
+# of the call, fatal errors are raised as exceptions instead of exiting
+        with self.lock:
+            token = current.set(self.state)
+            try:
+                yield
+            except SystemExit as e:
+                raise RuntimeError(e.code) from None
+            finally:
+                current.reset(token)
+    def stage(self, files):
+# Stage the input files and write the job scripts without submitting them
+        with self.activate():
+            dryrun = options.debug.dry_run
+            options.debug.dry_run = True
+            try:
+                return submitall(files)
+            finally:
+                options.debug.dry_run = dryrun
+    def submit_many(self, files):
+# Submit the input files as one batch, which shares the initialization,
+# the queue selection, the bundles and the admission control, and return
+# the job name, output directory and job number of each processed job
+        with self.activate():
+            return submitall(files)
+    def status(self, jobs):
+# Scheduler state of each job given by its result or output directory,
+# None when the job finished or is not known to the scheduler
+        states = {}
+        with self.activate():
+            for job in jobs:
+                outdir = job.outdir if hasattr(job, 'outdir') else AbsPath(job, parent=options.common.cwd)
+                try:
+                    with open(outdir/'.job'/'id', 'r') as f:
+                        states[outdir] = getbackend().status(f.read())
+                except FileNotFoundError:
+                    states[outdir] = None
+        return states
@@ -3,6 +3,7 @@ from pwd import getpwnam
 from grp import getgrgid
 from getpass import getuser 
 from socket import gethostname
+from contextvars import ContextVar
 from .utils import AttrDict, ConfDict
 from .fileutils import AbsPath
 
@@ -32,45 +33,108 @@ booleans = {
     'False': False
 }
 
-options = AttrDict()
+class SessionLocal:
+# Proxy to one of the objects of the state of the current session, so that
+# modules can keep importing them by name while several sessions run
+# concurrently in different threads or contexts
+    __slots__ = ('_key',)
+    def __init__(self, key):
+        object.__setattr__(self, '_key', key)
+    def _target(self):
+        return current.get()[self._key]
+    def __getattr__(self, attr):
+        return getattr(self._target(), attr)
+    def __setattr__(self, attr, value):
+        setattr(self._target(), attr, value)
+    def __delattr__(self, attr):
+        delattr(self._target(), attr)
+    def __getitem__(self, key):
+        return self._target()[key]
+    def __setitem__(self, key, value):
+        self._target()[key] = value
+    def __delitem__(self, key):
+        del self._target()[key]
+    def __contains__(self, key):
+        return key in self._target()
+    def __iter__(self):
+        return iter(self._target())
+    def __len__(self):
+        return len(self._target())
+    def __bool__(self):
+        return bool(self._target())
+    def __eq__(self, other):
+        return self._target() == other
+    def __repr__(self):
+        return repr(self._target())
+
+def newstate():
+# Configuration and runtime state of a session
+    state = AttrDict(
+        options = AttrDict(),
+        config = ConfDict(dict(
+            load = [],
+            source = [],
+            export = {},
+            versions = {},
+            defaults = {},
+            conflicts = {},
+            optargs = [],
+            posargs = [],
+            filekeys = {},
+            filevars = {},
+            restartfiles = {},
+            inputfiles = [],
+            outputfiles = [],
+            syncfiles = [],
+            ignorederrors = [],
+            transienterrors = [],
+            completed_states = [],
+            parameteropts = [],
+            parameterpaths = [],
+            interpolable = [],
+            interpolopts = [],
+            prescript = [],
+            postscript = [],
+            onscript = [],
+            offscript = [],
+            tracehooks = [],
+        )),
+        parameterdict = {},
+        parameterpaths = [],
+        interpolationdict = {},
+        script = AttrDict(),
+        names = AttrDict(),
+        nodes = AttrDict(),
+        paths = AttrDict(),
+        environ = AttrDict(),
+        settings = AttrDict(),
+        bundle = [],
+        status = AttrDict(initialized=False, harvested=False),
+        paramindex = AttrDict(listings={}, verified=set(), loaded=False, dirty=False),
+        tracing = AttrDict(hooks=[], summary={}, pending=[], buffering=True, timings=False, writer=None),
+    )
+    state.names.user = getuser()
+    state.names.host = gethostname()
+    state.names.group = getgrgid(getpwnam(getuser()).pw_gid).gr_name
+    state.paths.home = AbsPath(path.expanduser('~'))
+    state.paths.lock = state.paths.home/'.clusterqlock'
+    return state
 
-config = ConfDict(dict(
-    load = [],
-    source = [],
-    export = {},
-    versions = {},
-    defaults = {},
-    conflicts = {},
-    optargs = [],
-    posargs = [],
-    filekeys = {},
-    filevars = {},
-    fileopts = {},
-    inputfiles = [],
-    outputfiles = [],
-    ignorederrors = [],
-    parameteropts = [],
-    parameterpaths = [],
-    interpolable = [],
-    interpolopts = [],
-    prescript = [],
-    postscript = [],
-    onscript = [],
-    offscript = [],
-))
+# The command line uses the default state
+current = ContextVar('session', default=newstate())
 
-parameterdict = {}
-parameterpaths = []
-interpolationdict = {}
-script = AttrDict()
-names = AttrDict()
-nodes = AttrDict()
-paths = AttrDict()
-environ = AttrDict()
-settings = AttrDict()
-names.user = getuser()
-names.host = gethostname()
-names.group = getgrgid(getpwnam(getuser()).pw_gid).gr_name
-paths.home = AbsPath(path.expanduser('~'))
-paths.lock = paths.home/'.clusterqlock'
-status = AttrDict(initialized=False)
+options = SessionLocal('options')
+config = SessionLocal('config')
+parameterdict = SessionLocal('parameterdict')
+parameterpaths = SessionLocal('parameterpaths')
+interpolationdict = SessionLocal('interpolationdict')
+script = SessionLocal('script')
+names = SessionLocal('names')
+nodes = SessionLocal('nodes')
+paths = SessionLocal('paths')
+environ = SessionLocal('environ')
+settings = SessionLocal('settings')
+bundle = SessionLocal('bundle')
+status = SessionLocal('status')
+paramindex = SessionLocal('paramindex')
+tracing = SessionLocal('tracing')
@@ -1,37 +1,83 @@
-import os, sys, time
+import os, sys
+from functools import lru_cache
+from contextlib import ExitStack
 #from tkdialogs import messages, prompts
 from clinterface import messages, prompts, _
 from subprocess import CalledProcessError, call, check_output
-from .queue import submitjob, getjobstatus
-from .shared import ArgGroups, names, paths, config, options, environ, settings, status, script, parameterdict, interpolationdict, parameterpaths
-from .utils import ConfigTemplate, FilterGroupTemplate, InterpolationTemplate, option
+from .queue import dispatchjob, getjobstatus
+from .shared import ArgGroups, names, paths, config, options, environ, settings, status, script, parameterdict, interpolationdict, bundle
+from .utils import AttrDict, ConfigTemplate, FilterGroupTemplate, InterpolationTemplate, compiled_template, compiled_file, option
 from .initialization import initialize
 from .fileutils import AbsPath
+from .tracing import span
+from .bundling import addtask
+from .pilot import newtaskname, taskqueued, enqueue
+from .history import resources, directives, recordjob, fingerprint, findresult
+from .paramindex import assertparamdir, isparamdir, isparamfile, contentkey
+from .retry import replaycommand
+from .lease import acquire, release
 
 selector = prompts.Selector()
 completer = prompts.Completer()
 completer.set_truthy_options(['si', 'yes'])
 completer.set_falsy_options(['no'])
 
-def submit(workdir, inputname, filtergroups):
-
-    if not status.initialized:
-        initialize()
+@lru_cache(maxsize=1024)
+def parameterpath(path):
+# The trunk directories are checked once per batch, submitall clears the cache
+    trunk = AbsPath()
+    for part in AbsPath(path).parts:
+        assertparamdir(trunk)
+        trunk = trunk/part
+    return trunk
 
+def makejobname(inputname, step=None):
     if 'prefix' in settings:
         jobname = f'{settings.prefix}_{inputname}'
     elif 'suffix' in settings:
         jobname = f'{inputname}_{settings.suffix}'
     else:
         jobname = inputname
+    if step:
+        jobname = f'{jobname}_{step.name}'
+    return jobname
 
-    script.vars.append(f'jobname="{jobname}"')
-    script.meta.append(ConfigTemplate(config.jobname).substitute(jobname=jobname))
-
+def outputdir(workdir, jobname):
     if 'out' in options.common:
-        outdir = AbsPath(options.common.out, parent=workdir)
+        return AbsPath(options.common.out, parent=workdir)
     else:
-        outdir = AbsPath(jobname, parent=workdir)
+        return AbsPath(jobname, parent=workdir)
+
+def submit(workdir, inputname, filtergroups, step=None, previous=None):
+# The claim on the job directory is released however the submission ends
+    with ExitStack() as claims:
+        return processjob(claims, workdir, inputname, filtergroups, step, previous)
+
+def processjob(claims, workdir, inputname, filtergroups, step, previous):
+
+    if not status.initialized:
+        initialize()
+
+    jobname = makejobname(inputname, step)
+
+    sources = {}
+    linkedfiles = {}
+
+    for key in config.inputfiles:
+        if previous and key in step.linked:
+            linkedfiles[key] = previous.outdir/previous.jobname*step.linked[key]
+            continue
+        if key in settings.restartfiles:
+            linkedfiles[key] = settings.restartfiles[key]
+        if step and key in step.inputs:
+            sources[key] = step.inputs[key]
+        elif (workdir/inputname*key).isfile():
+            sources[key] = workdir/inputname*key
+
+    outdir = outputdir(workdir, jobname)
+
+    if outdir/jobname in settings.completed:
+        return AttrDict(jobname=jobname, outdir=outdir, jobid=None)
 
     literalfiles = {}
     interpolatedfiles = {}
@@ -43,79 +89,105 @@ def submit(workdir, inputname, filtergroups):
             messages.failure(_('El directorio de salida debe ser distinto al directorio de trabajo'))
             return
         stagedir = outdir
-        for key in config.inputfiles:
-            srcpath = workdir/inputname*key
+        for key, srcpath in sources.items():
             destpath = stagedir/jobname*key
-            if srcpath.isfile():
-                if 'interpolable' in config and key in config.interpolable:
-                    with open(srcpath, 'r') as f:
-                        contents = f.read()
-                        if options.interpolate:
-                            try:
-                                interpolatedfiles[destpath] = InterpolationTemplate(contents).substitute(interpolationdict)
-                            except ValueError:
-                                messages.failure(_('El archivo $file contiene variables de interpolación inválidas', file=srcpath), f'key={e.args[0]}')
-                                return
-                            except KeyError as e:
-                                messages.failure(_('El archivo $file contiene variables de interpolación indefinidas', file=srcpath), f'key={e.args[0]}')
-                                return
-                        else:
-                            try:
-                                interpolatedfiles[destpath] = InterpolationTemplate(contents).substitute({})
-                            except ValueError:
-                                pass
-                            except KeyError as e:
-                                completer.set_message(_('Parece que hay variables de interpolación en el archivo $file ¿desea continuar sin interpolar?', file=srcpath))
-                                if completer.binary_choice():
-                                    literalfiles[destpath] = srcpath
-                                else:
-                                    return
-                else:
+            if key in linkedfiles:
+                messages.failure(_('El archivo $file entra en conflicto con el archivo $linkedfile', file=srcpath, linkedfile=linkedfiles[key]))
+                return
+            if 'interpolable' in config and key in config.interpolable:
+                template = compiled_file(InterpolationTemplate, srcpath)
+                if options.interpolate:
+                    try:
+                        template.validate(interpolationdict)
+                    except ValueError as e:
+                        messages.failure(_('El archivo $file contiene variables de interpolación inválidas', file=srcpath), e.args[0])
+                        return
+                    except KeyError as e:
+                        messages.failure(_('El archivo $file contiene variables de interpolación indefinidas', file=srcpath), f'key={e.args[0]}')
+                        return
+                    interpolatedfiles[destpath] = template
+                elif template.literal:
                     literalfiles[destpath] = srcpath
+                else:
+                    try:
+                        template.validate()
+                    except ValueError:
+                        literalfiles[destpath] = srcpath
+                    except KeyError as e:
+                        completer.set_message(_('Parece que hay variables de interpolación en el archivo $file ¿desea continuar sin interpolar?', file=srcpath))
+                        if completer.binary_choice():
+                            literalfiles[destpath] = srcpath
+                        else:
+                            return
+                    else:
+                        interpolatedfiles[destpath] = template
+            else:
+                literalfiles[destpath] = srcpath
 
     jobdir = stagedir/'.job'
 
-    if outdir.isdir():
-        if jobdir.isdir():
-            try:
-                with open(jobdir/'id', 'r') as f:
-                    jobid = f.read()
-                success, jobstatus = getjobstatus(jobid)
-                if not success:
-                    messages.failure(InterpolationTemplate(jobstatus).substitute(name=jobname, path=outdir))
-                    return
-            except FileNotFoundError:
-                pass
-        if not set(outdir.listdir()).isdisjoint(f'{jobname}.{key}' for key in config.outputfiles):
-            completer.set_message(_('Si corre este cálculo los archivos de salida existentes en el directorio $outdir serán sobreescritos, ¿desea continuar de todas formas?', outdir=outdir))
-            if options.common.no or (not options.common.yes and not completer.binary_choice()):
-                messages.failure(_('Cancelado por el usuario'))
-                return
-        if workdir != outdir:
-            for ext in config.inputfiles:
-                (outdir/jobname*ext).remove()
-        for ext in config.outputfiles:
-            (outdir/jobname*ext).remove()
-    else:
-        try:
-            outdir.makedirs()
-        except FileExistsError:
-            messages.failure(_('No se puede crear la carpeta $outdir porque ya existe un archivo con el mismo nombre', outdir=outdir))
+    for key, source in linkedfiles.items():
+        if os.path.realpath(source) in (os.path.realpath(outdir/jobname*ext) for ext in config.inputfiles + config.outputfiles):
+            messages.failure(_('El archivo $file sería sobreescrito por el trabajo "$jobname"', file=source, jobname=jobname))
             return
 
-    for destpath, litfile in literalfiles.items():
-        litfile.copyas(destpath)
+    try:
+        outdir.makedirs()
+    except FileExistsError:
+        messages.failure(_('No se puede crear la carpeta $outdir porque ya existe un archivo con el mismo nombre', outdir=outdir))
+        return
 
-    for destpath, contents in interpolatedfiles.items():
-        with open(destpath, 'w') as f:
-            f.write(contents)
+    try:
+        jobdir.mkdir()
+    except FileExistsError:
+        messages.failure(_('No se puede crear la carpeta $jobdir porque ya existe un archivo con ese nombre', jobdir=jobdir))
+        return
 
-#    for key, targetfile in options.restartfiles.items():
-#        targetfile.symlink(stagedir/jobname*config.fileopts[key])
+    # Claim the job directory before looking at its contents, so that only
+    # one of several concurrent submitters processes the job
+    owner = acquire(jobdir)
+    if owner:
+        messages.failure(_('El trabajo "$name" no se envió porque el proceso $owner está enviando otro trabajo usando el directorio $path', name=jobname, owner=owner, path=outdir))
+        return
+    claims.callback(release, jobdir)
+
+    try:
+        with open(jobdir/'id', 'r') as f:
+            jobid = f.read()
+        success, jobstatus = getjobstatus(jobid)
+        if not success:
+            messages.failure(InterpolationTemplate(jobstatus).substitute(name=jobname, path=outdir))
+            return
+    except FileNotFoundError:
+        pass
+    try:
+        with open(jobdir/'task', 'r') as f:
+            if taskqueued(f.read()):
+                messages.failure(_('El trabajo "$name" no se envió porque hay otro trabajo en la cola de los pilotos usando el directorio $path', name=jobname, path=outdir))
+                return
+    except FileNotFoundError:
+        pass
+    if not set(outdir.listdir()).isdisjoint(f'{jobname}.{key}' for key in config.outputfiles):
+        completer.set_message(_('Si corre este cálculo los archivos de salida existentes en el directorio $outdir serán sobreescritos, ¿desea continuar de todas formas?', outdir=outdir))
+        if options.common.no or (not options.common.yes and not options.common.resume and not completer.binary_choice()):
+            messages.failure(_('Cancelado por el usuario'))
+            return
+    if workdir != outdir:
+        for ext in config.inputfiles:
+            (outdir/jobname*ext).remove()
+
+    with span('stage'):
+        for destpath, litfile in literalfiles.items():
+            litfile.copyas(destpath)
+        for destpath, template in interpolatedfiles.items():
+            with open(destpath, 'w') as f:
+                template.write(f, interpolationdict)
 
     ############ Remote execution ###########
 
     if options.remote.remote_host:
+        for ext in config.outputfiles:
+            (outdir/jobname*ext).remove()
         remote_args = ArgGroups()
         reloutdir = os.path.relpath(outdir, paths.home)
         remote_tmpdir = paths.remotedir/names.user*names.host/'tmp'
@@ -154,84 +226,146 @@ def submit(workdir, inputname, filtergroups):
 
     ############ Local execution ###########
 
+    parameterpaths = []
+
     for path in config.parameterpaths:
         try:
-            path = ConfigTemplate(path).safe_substitute(names)
-            path = FilterGroupTemplate(path).substitute(filtergroups)
-            path = InterpolationTemplate(path).substitute(parameterdict)
+            path = compiled_template(ConfigTemplate, path).safe_substitute(names)
+            path = compiled_template(FilterGroupTemplate, path).substitute(filtergroups)
+            path = compiled_template(InterpolationTemplate, path).substitute(parameterdict)
         except ValueError as e:
             messages.error(_('La ruta $path contiene variables de interpolación inválidas', path=path), f'key={e.args[0]}')
         except KeyError as e:
             messages.error(_('La ruta $path contiene variables de interpolación indefinidas', path=path), f'key={e.args[0]}')
-        trunk = AbsPath()
-        for part in AbsPath(path).parts:
-            trunk.assertdir()
-            trunk = trunk/part
-        parameterpaths.append(trunk)
+        parameterpaths.append(parameterpath(path))
+
+    # Link the outputs of an identical calculation instead of submitting
+    # the job again, unless some input is the output of a pending job. The
+    # outputs of the previous job are kept until then because they may be
+    # the results that are reused
+    if options.common.raw:
+        inputfiles = dict(sources)
+    else:
+        inputfiles = {key: stagedir/jobname*key for key in sources}
+    inputfiles.update(linkedfiles)
+    missing = [path for path in inputfiles.values() if not path.isfile()]
+    if options.common.no_reuse:
+        jobhash = None
+    elif missing:
+        messages.warning(_('No se buscarán resultados reutilizables para el trabajo "$jobname" porque el archivo $file todavía no existe', jobname=jobname, file=missing[0]))
+        jobhash = None
+    else:
+        jobhash = fingerprint(inputfiles, parameterpaths)
+        result = findresult(jobhash)
+        if result:
+            resultdir, resultname = result
+            if options.debug.dry_run:
+                messages.success(_('Se reutilizarían los resultados del trabajo "$jobname" en $outdir', jobname=resultname, outdir=resultdir))
+                return AttrDict(jobname=jobname, outdir=outdir, jobid=None)
+            if (resultdir, resultname) == (outdir, jobname):
+                messages.success(_('El trabajo "$jobname" no se envió porque sus resultados en $outdir están al día', jobname=jobname, outdir=outdir))
+                return AttrDict(jobname=jobname, outdir=outdir, jobid=None)
+            for key in config.outputfiles:
+                (outdir/jobname*key).remove()
+                if (resultdir/resultname*key).isfile():
+                    try:
+                        os.link(resultdir/resultname*key, outdir/jobname*key)
+                    except OSError:
+                        (resultdir/resultname*key).copyas(outdir/jobname*key)
+            messages.success(_('El trabajo "$jobname" no se envió porque se reutilizaron los resultados del trabajo "$prevname" en $outdir', jobname=jobname, prevname=resultname, outdir=resultdir))
+            return AttrDict(jobname=jobname, outdir=outdir, jobid=None)
+
+    for ext in config.outputfiles:
+        (outdir/jobname*ext).remove()
+
+    if 'bundle' in options.common:
+        execdir = settings.execdir/str(len(bundle) + 1)
+    elif options.common.pilot:
+        taskname = newtaskname()
+        execdir = settings.execdir/taskname
+    else:
+        execdir = settings.execdir
 
     imports = []
     exports = []
 
     for key in config.inputfiles:
-        if (workdir/inputname*key).isfile():
-            imports.append(script.importfile(stagedir/jobname*key, settings.execdir/config.filekeys[key]))
-
-#    for key in options.restartfiles:
-#        imports.append(script.importfile(stagedir/jobname*config.fileopts[key], settings.execdir/config.filekeys[config.fileopts[key]]))
+        if key in linkedfiles:
+            imports.append(script.copyfile(linkedfiles[key], execdir/config.filekeys[key]))
+        elif key in sources:
+            imports.append(script.importfile(stagedir/jobname*key, execdir/config.filekeys[key]))
 
     for path in parameterpaths:
-        if path.isfile():
-            imports.append(script.importfile(path, settings.execdir/path.name))
-        elif path.isdir():
-            imports.append(script.importdir(path, settings.execdir))
+        if isparamfile(path):
+            if 'nodecache' in config:
+                imports.append(script.cacheimport(path, contentkey(path), execdir/path.name))
+            else:
+                imports.append(script.importfile(path, execdir/path.name))
+        elif isparamdir(path):
+            if 'nodecache' in config:
+                imports.append(script.cacheimport(path, contentkey(path), execdir))
+            else:
+                imports.append(script.importdir(path, execdir))
         else:
             messages.error(_('La ruta de parámetros $path no existe', path=path))
 
     for key in config.outputfiles:
-        exports.append(script.exportfile(settings.execdir/config.filekeys[key], outdir/jobname*key))
+        exports.append(script.exportfile(execdir/config.filekeys[key], outdir/jobname*key))
 
-    try:
-        jobdir.mkdir()
-    except FileExistsError:
-        messages.failure(_('No se puede crear la carpeta $jobdir porque ya existe un archivo con ese nombre', jobdir=jobdir))
+    if 'stdoutfile' in config:
+        livefile = (execdir/config.filekeys[config.stdoutfile], outdir/jobname*config.stdoutfile)
+    elif 'log' in config.filekeys:
+        livefile = (execdir/config.filekeys['log'], outdir/jobname*'log')
+    else:
+        livefile = None
+
+    if settings.syncinterval is not None:
+        syncfiles = [(execdir/config.filekeys[key], outdir/jobname*key) for key in config.syncfiles]
+    else:
+        syncfiles = []
+
+    (jobdir/'info').remove()
+
+    if linkedfiles:
+        restartdir = jobdir/'restart'
+        restartdir.mkdir()
+        for filename in restartdir.listdir():
+            (restartdir/filename).remove()
+        for key, source in linkedfiles.items():
+            source.symlink(restartdir/jobname*key)
+
+    if 'bundle' in options.common:
+        addtask(claims, jobname, jobdir, execdir, imports, exports)
+        return
+
+    if options.common.pilot:
+        enqueue(taskname, jobname, jobdir, execdir, imports, exports)
         return
 
     jobscript = jobdir/'script'
+    inputsize = sum(os.path.getsize(path) for path in sources.values())
+    walltime, memory = resources(inputsize, settings.natoms)
+    meta = directives(walltime, memory)
+    jobvars = []
+
+    if previous and previous.jobid:
+        meta.append(compiled_template(ConfigTemplate, config.dependency).substitute(jobid=previous.jobid))
 
-    with open(jobscript, 'w') as f:
-        f.write('#!/bin/bash -x' + '\n')
-        f.write(''.join(i + '\n' for i in script.meta))
-        f.write('shopt -s extglob nullglob' + '\n')
-        f.write(''.join(i + '\n' for i in script.vars))
-        f.write(''.join(i + '\n' for i in script.config))
-        f.write(script.makedir(settings.execdir) + '\n')
-        f.write(''.join(i + '\n' for i in imports))
-        f.write(script.chdir(settings.execdir) + '\n')
-        f.write(''.join(i + '\n' for i in config.prescript))
-        f.write(' '.join(script.body) + '\n')
-        f.write(''.join(i + '\n' for i in config.postscript))
-        f.write(''.join(i + '\n' for i in exports))
-        f.write(script.removedir(settings.execdir) + '\n')
-        f.write(''.join(i + '\n' for i in config.offscript))
+    if memory is not None:
+        jobvars.append(f'maxram={memory*1024}')
+
+    with span('script'), open(jobscript, 'w') as f:
+        f.write(script.skeleton.render(jobname, imports, exports, jobdir, meta, jobvars, syncfiles, livefile))
 
     if options.debug.dry_run:
 
         messages.success(_('Se procesó el trabajo "$jobname" y se generaron los archivos para el envío en el directorio $jobdir', jobname=jobname, jobdir=jobdir))
+        jobid = None
 
     else:
 
         try:
-            delay = float(config.delay) + os.stat(paths.lock).st_mtime - time.time()
-        except ValueError:
-            messages.error(_('Se esperaba un valor numérico'), f'delay={config.delay}')
-        except (FileNotFoundError) as e:
-            pass
-        else:
-            if delay > 0:
-                time.sleep(delay)
-    
-        try:
-            jobid = submitjob(jobscript)
+            jobid = dispatchjob(jobscript)
         except RuntimeError as error:
             messages.failure(_('El gestor de trabajos reportó el siguiente error al enviar el trabajo $jobname: $error', jobname=jobname, error=error))
             return
@@ -239,5 +373,6 @@ def submit(workdir, inputname, filtergroups):
             messages.success(_('El trabajo "$jobname" se correrá en $nproc núcleo(s) en $clustername con el número $jobid', jobname=jobname, nproc=options.common.nproc, clustername=names.cluster, jobid=jobid))
             with open(jobdir/'id', 'w') as f:
                 f.write(jobid)
-            with open(paths.lock, 'a'):
-                os.utime(paths.lock, None)
+            recordjob(jobid, jobname, outdir, inputsize, settings.natoms, walltime, memory, jobhash, replaycommand(workdir, inputname))
+
+    return AttrDict(jobname=jobname, outdir=outdir, jobid=jobid)
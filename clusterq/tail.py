@@ -0,0 +1,214 @@
+import os
+import sys
+import time
+import shlex
+import ctypes
+import ctypes.util
+import socket
+import struct
+from select import select
+from argparse import ArgumentParser
+from subprocess import Popen, PIPE, TimeoutExpired
+from clinterface import messages, _
+from .shared import config
+from .fileutils import AbsPath
+from .queue import getbackend
+from .configuration import loadconfig
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVE_SELF = 0x00000800
+IN_DELETE_SELF = 0x00000400
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+chunksize = 65536
+checkinterval = 5
+
+class Watcher:
+# Wait for changes of a file with inotify, or by polling its size and
+# modification time where inotify is not available
+    def __init__(self, path):
+        self.path = path
+        self.fd = -1
+        self.gone = False
+        libc = ctypes.util.find_library('c')
+        if libc is not None:
+            libc = ctypes.CDLL(libc, use_errno=True)
+            if hasattr(libc, 'inotify_init1'):
+                self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+                if self.fd >= 0 and libc.inotify_add_watch(self.fd, os.fsencode(path), IN_MODIFY | IN_ATTRIB | IN_MOVE_SELF | IN_DELETE_SELF) < 0:
+                    os.close(self.fd)
+                    self.fd = -1
+        self.stat = self.getstat()
+    def getstat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+    def wait(self, timeout):
+        if self.fd >= 0:
+            if select([self.fd], [], [], timeout)[0]:
+                data = os.read(self.fd, 4096)
+                offset = 0
+                while offset < len(data):
+                    mask, length = struct.unpack_from('iIII', data, offset)[1::2]
+                    if mask & (IN_MOVE_SELF | IN_DELETE_SELF):
+                        self.gone = True
+                    offset += 16 + length
+        else:
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                stat = self.getstat()
+                if stat != self.stat:
+                    self.stat = stat
+                    if stat is None:
+                        self.gone = True
+                    break
+                time.sleep(1)
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+
+def skiplines(f, count):
+# Offset of the last count lines reading the file backwards by chunks
+    end = f.seek(0, os.SEEK_END)
+    if count <= 0:
+        return end
+    offset = end
+    newlines = 0
+    while offset > 0:
+        size = min(chunksize, offset)
+        offset -= size
+        f.seek(offset)
+        chunk = f.read(size)
+        if offset + size == end and chunk.endswith(b'\n'):
+            chunk = chunk[:-1]
+        position = len(chunk)
+        while position > 0:
+            position = chunk.rfind(b'\n', 0, position)
+            if position < 0:
+                break
+            newlines += 1
+            if newlines == count:
+                return offset + position + 1
+    return 0
+
+def copydata(f, offset):
+# Write the data appended since offset in bounded chunks
+    size = os.fstat(f.fileno()).st_size
+    if size < offset:
+        offset = 0
+    f.seek(offset)
+    while True:
+        chunk = f.read(chunksize)
+        if not chunk:
+            break
+        sys.stdout.buffer.write(chunk)
+        offset += len(chunk)
+    sys.stdout.buffer.flush()
+    return offset
+
+def finished(jobid):
+    try:
+        state = getbackend().status(jobid)
+    except (LookupError, RuntimeError):
+        return False
+    return state is None or state in config.finished_states
+
+def printfile(path, lines):
+    try:
+        with open(path, 'rb') as f:
+            copydata(f, skiplines(f, lines))
+    except FileNotFoundError:
+        messages.failure(_('No existe el archivo $path', path=path))
+
+def followlocal(jobid, path, lines):
+# Stream the file with inotify until the job finishes or the file is removed,
+# the file is also read every check interval because writes from other hosts
+# to a shared file system are not notified
+    while not os.path.isfile(path):
+        if finished(jobid):
+            return 0
+        time.sleep(1)
+    watcher = Watcher(path)
+    lastcheck = time.time()
+    try:
+        with open(path, 'rb') as f:
+            offset = copydata(f, skiplines(f, lines))
+            while not watcher.gone and os.path.exists(path):
+                watcher.wait(checkinterval)
+                offset = copydata(f, offset)
+                if time.time() - lastcheck > checkinterval:
+                    if finished(jobid):
+                        break
+                    lastcheck = time.time()
+    finally:
+        watcher.close()
+    return offset
+
+def followremote(jobid, host, path, lines):
+# Relay the output of tail running on the execution host until the job
+# finishes, the remote tail is killed when its standard input is closed
+    shell = 'rsh' if config.filesync == 'remote' else 'ssh'
+    process = Popen([shell, host, f'tail -n {lines} -F {shlex.quote(path)} 2> /dev/null & read x; kill $!'], stdin=PIPE)
+    try:
+        while process.poll() is None:
+            time.sleep(checkinterval)
+            if finished(jobid):
+                break
+    finally:
+        process.stdin.close()
+        try:
+            process.wait(timeout=checkinterval)
+        except TimeoutExpired:
+            process.terminate()
+            process.wait()
+
+def clusterq_tail(arglist):
+
+    parser = ArgumentParser(prog='clusterq tail', description='Muestra la salida del programa mientras corre el trabajo.')
+    parser.add_argument('job', metavar='PATH', help='Directorio de salida del trabajo.')
+    parser.add_argument('-n', '--lines', type=int, metavar='LINES', default=10, help='Mostrar inicialmente las últimas LINES líneas.')
+    parser.add_argument('--cfgdir', metavar='PATH', default=os.environ.get('CLUSTERQCFG'), help='Usar la configuración del directorio PATH.')
+    args = parser.parse_args(arglist)
+
+    loadconfig(args.cfgdir)
+
+    jobdir = AbsPath(args.job, parent=os.getcwd())/'.job'
+
+    try:
+        with open(jobdir/'id', 'r') as f:
+            jobid = f.read()
+    except FileNotFoundError:
+        messages.error(_('No se envió ningún trabajo desde el directorio $path', path=jobdir.parent()))
+
+    # The job script writes the info file when the job starts
+    while not (jobdir/'info').isfile():
+        if finished(jobid):
+            messages.error(_('El trabajo $jobid terminó sin iniciar la salida del programa', jobid=jobid))
+        time.sleep(checkinterval)
+
+    with open(jobdir/'info', 'r') as f:
+        host, livepath, finalpath = f.read().splitlines()[:3]
+
+    if finished(jobid):
+        printfile(finalpath, args.lines)
+        return
+
+    # The output is read directly when the scratch is in a shared file
+    # system or on this host, and relayed from the execution host otherwise
+    try:
+        if config.filesync == 'local' or host.split('.')[0] == socket.gethostname().split('.')[0]:
+            offset = followlocal(jobid, livepath, args.lines)
+            # Print what was written after the last read from the copy
+            # in the output directory
+            if not os.path.isfile(livepath) and os.path.isfile(finalpath):
+                with open(finalpath, 'rb') as f:
+                    copydata(f, offset)
+        else:
+            followremote(jobid, host, livepath, args.lines)
+    except KeyboardInterrupt:
+        pass
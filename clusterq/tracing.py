@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import atexit
+import threading
+from functools import wraps
+from importlib import import_module
+from contextlib import contextmanager
+from clinterface import messages, _
+from .shared import tracing
+
+# Spans are recorded as dicts with the keys name, start (epoch seconds),
+# duration (seconds), args, pid and tid, and are passed to every hook. The
+# hooks, the summary and the spans recorded before the tracer is configured
+# belong to the session
+
+local = threading.local()
+lock = threading.Lock()
+
+class TraceWriter:
+    def __init__(self, path, format):
+        self.file = open(path, 'w')
+        self.format = format
+        self.count = 0
+        if format == 'chrome':
+            self.file.write('[\n')
+    def __call__(self, record):
+        if self.format == 'chrome':
+            event = dict(
+                name = record['name'],
+                cat = 'clusterq',
+                ph = 'X',
+                ts = int(record['start']*1e6),
+                dur = int(record['duration']*1e6),
+                pid = record['pid'],
+                tid = record['tid'],
+                args = record['args'],
+            )
+            if self.count:
+                self.file.write(',\n')
+            self.file.write(json.dumps(event, default=str))
+        else:
+            self.file.write(json.dumps(record, default=str) + '\n')
+        self.count += 1
+    def close(self):
+        if self.format == 'chrome':
+            self.file.write('\n]\n')
+        self.file.close()
+
+class Tracer:
+    def configure(self, timings=False, trace=None, format='jsonl', hookspecs=[]):
+        tracing.timings = timings
+        if trace is not None:
+            try:
+                tracing.writer = TraceWriter(trace, format)
+            except OSError as e:
+                messages.error(_('No se pudo abrir el archivo de trazas $file', file=trace), str(e))
+            tracing.hooks.append(tracing.writer)
+            # The trace is also completed when the command exits early
+            atexit.register(self.finish)
+        for spec in hookspecs:
+            tracing.hooks.append(load_hook(spec))
+        with lock:
+            tracing.buffering = False
+            records = list(tracing.pending)
+            tracing.pending.clear()
+        for record in records:
+            emit(record)
+    def discard(self):
+# Stop buffering the spans of a session that will not configure a tracer
+        with lock:
+            tracing.buffering = False
+            tracing.pending.clear()
+    def finish(self):
+        if tracing.timings and tracing.summary:
+            print_summary()
+            tracing.timings = False
+        if tracing.writer is not None:
+            tracing.hooks.remove(tracing.writer)
+            tracing.writer.close()
+            tracing.writer = None
+
+tracer = Tracer()
+
+def load_hook(spec):
+# Hooks are specified as module:function
+    try:
+        modulename, funcname = spec.split(':')
+        return getattr(import_module(modulename), funcname)
+    except (ValueError, ImportError, AttributeError) as e:
+        messages.error(_('No se pudo cargar el gancho de trazas $hook', hook=spec), str(e))
+
+def add_hook(hook):
+    tracing.hooks.append(hook)
+
+def remove_hook(hook):
+    tracing.hooks.remove(hook)
+
+def current():
+    stack = getattr(local, 'stack', None)
+    if stack:
+        return stack[-1]
+
+def emit(record):
+    for hook in tracing.hooks:
+        hook(record)
+
+def record(name, start, duration, args):
+    entry = dict(name=name, start=start, duration=duration, args=args, pid=os.getpid(), tid=threading.get_ident())
+    with lock:
+        stats = tracing.summary.setdefault(name, [0, 0., 0.])
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] = max(stats[2], duration)
+        if tracing.buffering:
+            tracing.pending.append(entry)
+            return
+    if tracing.hooks:
+        emit(entry)
+
+@contextmanager
+def span(name, **args):
+    if not hasattr(local, 'stack'):
+        local.stack = []
+    local.stack.append(name)
+    start = time.time()
+    counter = time.perf_counter()
+    try:
+        yield args
+    finally:
+        duration = time.perf_counter() - counter
+        local.stack.pop()
+        record(name, start, duration, args)
+
+def traced(name):
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def print_summary():
+    print(_('Tiempos de ejecución:'))
+    print(f"{'fase':<16}{'llamadas':>10}{'total (s)':>12}{'media (ms)':>12}{'máximo (ms)':>13}")
+    for name, (count, total, maximum) in sorted(tracing.summary.items(), key=lambda x: -x[1][1]):
+        print(f'{name:<16}{count:>10}{total:>12.3f}{1e3*total/count:>12.3f}{1e3*maximum:>13.3f}')
@@ -1,5 +1,7 @@
+import os
 import re
 import pyjson5 as json5
+from functools import lru_cache
 from clinterface import messages, _
 from string import Template, Formatter
 
@@ -71,6 +73,83 @@ class InterpolationTemplate(Template):
 class FormatKeyError(Exception):
     pass
 
+class CompiledTemplate:
+# Template tokenized once so that it can be substituted many times
+    def __init__(self, templateclass, template):
+        self.chunks = []
+        self.fields = []
+        self.keys = set()
+        self.escaped = False
+        delimiter = templateclass.delimiter
+        start = 0
+        chunk = ''
+        for mo in templateclass.pattern.finditer(template):
+            chunk += template[start:mo.start()]
+            start = mo.end()
+            if mo.group('escaped') is not None:
+                chunk += delimiter
+                self.escaped = True
+                continue
+            key = mo.group('named') or mo.group('braced')
+            if key is None:
+                lines = template[:mo.start('invalid')].splitlines(keepends=True)
+                if lines:
+                    position = (len(lines), mo.start('invalid') - len(''.join(lines[:-1])))
+                else:
+                    position = (1, 1)
+                self.fields.append((None, mo.group(), position))
+            else:
+                self.keys.add(key)
+                self.fields.append((key, mo.group(), None))
+            self.chunks.append(chunk)
+            chunk = ''
+        self.chunks.append(chunk + template[start:])
+    @property
+    def literal(self):
+        return not self.fields and not self.escaped
+    def validate(self, mapping={}):
+        for key, text, position in self.fields:
+            if key is None:
+                raise ValueError('Invalid placeholder in string: line {}, col {}'.format(*position))
+            if key not in mapping:
+                raise KeyError(key)
+    def iter_substitute(self, mapping={}, safe=False):
+        yield self.chunks[0]
+        for (key, text, position), chunk in zip(self.fields, self.chunks[1:]):
+            if key is None:
+                if not safe:
+                    raise ValueError('Invalid placeholder in string: line {}, col {}'.format(*position))
+                yield text
+            elif safe and key not in mapping:
+                yield text
+            else:
+                yield str(mapping[key])
+            yield chunk
+    def substitute(self, mapping={}, **kwargs):
+        if kwargs:
+            mapping = dict(mapping, **kwargs)
+        return ''.join(self.iter_substitute(mapping))
+    def safe_substitute(self, mapping={}, **kwargs):
+        if kwargs:
+            mapping = dict(mapping, **kwargs)
+        return ''.join(self.iter_substitute(mapping, safe=True))
+    def write(self, file, mapping={}):
+        file.writelines(self.iter_substitute(mapping))
+
+@lru_cache(maxsize=1024)
+def compiled_template(templateclass, template):
+    return CompiledTemplate(templateclass, template)
+
+@lru_cache(maxsize=128)
+def _compiled_file(templateclass, path, mtime, size):
+    with open(path, 'r') as f:
+        return CompiledTemplate(templateclass, f.read())
+
+def compiled_file(templateclass, path):
+# Files are recompiled only when their size or modification time change
+    stat = os.stat(path)
+    return _compiled_file(templateclass, path, stat.st_mtime_ns, stat.st_size)
+
 def readspec(file):
     with open(file, 'r') as f:
         try:
@@ -0,0 +1,67 @@
+from clinterface import messages, _
+from .shared import config, options
+from .utils import AttrDict, readspec
+from .fileutils import AbsPath
+from .submission import submit
+from .tracing import span
+
+def loadworkflow(path):
+# Each step is submitted as a separate job named after the input and the
+# step, which depends on the job of the previous step. The input files of
+# a step are those of the original input, overridden by the files listed
+# in "inputs" and by the output files of the previous step listed in "from"
+    path = AbsPath(path, parent=options.common.cwd)
+    try:
+        path.assertfile()
+    except FileNotFoundError:
+        messages.error(_('El archivo de flujo de trabajo $file no existe', file=path))
+    spec = readspec(path)
+    if not spec.get('steps'):
+        messages.error(_('El flujo de trabajo no tiene pasos'), f'{path}: steps')
+    if not 'dependency' in config:
+        messages.error(_('El gestor de trabajos no admite dependencias entre trabajos'), 'config.dependency')
+    if 'out' in options.common:
+        messages.error(_('No se puede especificar el directorio de salida de un flujo de trabajo'))
+    if options.common.raw or 'bundle' in options.common or options.common.pilot:
+        messages.error(_('Los flujos de trabajo no se pueden combinar con --raw, --bundle o --pilot'))
+    if options.remote.remote_host:
+        messages.error(_('No se pueden enviar flujos de trabajo a un servidor remoto'))
+    steps = []
+    for i, step in enumerate(spec['steps']):
+        if not step.get('name'):
+            messages.error(_('El paso $step del flujo de trabajo no tiene nombre', step=i + 1), f'{path}: steps[{i}].name')
+        if step['name'] in (s.name for s in steps):
+            messages.error(_('El nombre del paso $name está repetido', name=step['name']), f'{path}: steps[{i}].name')
+        inputs = {}
+        for key, file in step.get('inputs', {}).items():
+            if not key in config.inputfiles:
+                messages.error(_('$key no es un archivo de entrada de $program', key=key, program=config.progname), f'{path}: steps[{i}].inputs')
+            inputs[key] = AbsPath(file, parent=path.parent())
+            try:
+                inputs[key].assertfile()
+            except FileNotFoundError:
+                messages.error(_('El archivo de entrada $file no existe', file=inputs[key]), f'{path}: steps[{i}].inputs')
+        linked = step.get('from', {})
+        if linked and not steps:
+            messages.error(_('El primer paso del flujo de trabajo no puede tomar archivos de un paso anterior'), f'{path}: steps[{i}].from')
+        for key, outkey in linked.items():
+            if key in inputs:
+                messages.error(_('El archivo de entrada $key del paso $name se especificó dos veces', key=key, name=step['name']), f'{path}: steps[{i}].from')
+            if not key in config.inputfiles:
+                messages.error(_('$key no es un archivo de entrada de $program', key=key, program=config.progname), f'{path}: steps[{i}].from')
+            if not outkey in config.outputfiles:
+                messages.error(_('$key no es un archivo de salida de $program', key=outkey, program=config.progname), f'{path}: steps[{i}].from')
+        steps.append(AttrDict(name=step['name'], inputs=inputs, linked=linked))
+    return steps
+
+def submitworkflow(steps, workdir, inputname, filtergroups):
+# Stop at the first step that fails because the next ones depend on it
+    previous = None
+    for step in steps:
+        with span('step', step=step.name):
+            previous = submit(workdir, inputname, filtergroups, step, previous)
+        if previous is None:
+            if step is not steps[-1]:
+                messages.warning(_('No se enviaron los pasos siguientes del flujo de trabajo de $input', input=inputname))
+            break
+    return previous
@@ -0,0 +1,18 @@
+# Tests of the clusterq modules, run with python -m pytest tests
+
+import os
+import sys
+
+rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, rootdir)
+
+import pytest
+from clusterq.shared import current, newstate
+
+@pytest.fixture
+def state():
+# Run the test with a fresh state as a session does
+    state = newstate()
+    token = current.set(state)
+    yield state
+    current.reset(token)
@@ -0,0 +1,73 @@
+# Stand-in for the REST API of Slurm that keeps the jobs in memory, used
+# to test the REST backend without a cluster
+
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+    def log_message(self, *args):
+        pass
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    def dispatch(self, method):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length)) if length else None
+        with server.lock:
+            server.requests.append((method, self.path, self.headers.get('X-SLURM-USER-TOKEN'), body))
+            if self.headers.get('X-SLURM-USER-TOKEN') != server.token:
+                return self.reply(401, {'errors': [{'error': 'Authentication failure'}]})
+            match = re.fullmatch(r'/slurm/[^/]+/job/(\d+)', self.path)
+            if method == 'POST' and self.path.endswith('/job/submit'):
+                server.lastid += 1
+                server.jobs[server.lastid] = dict(body['job'], job_id=server.lastid, job_state=['PENDING'])
+                return self.reply(200, {'job_id': server.lastid, 'errors': []})
+            elif method == 'GET' and self.path.endswith('/jobs'):
+                return self.reply(200, {'jobs': list(server.jobs.values()), 'errors': []})
+            elif match and int(match.group(1)) in server.jobs:
+                job = server.jobs[int(match.group(1))]
+                if method == 'DELETE':
+                    job['job_state'] = ['CANCELLED']
+                return self.reply(200, {'jobs': [job], 'errors': []})
+            elif match:
+                return self.reply(500, {'errors': [{'error': 'Invalid job id specified', 'error_number': 2017}]})
+            return self.reply(404, {'errors': [{'error': 'Unknown path'}]})
+    def do_GET(self):
+        self.dispatch('GET')
+    def do_POST(self):
+        self.dispatch('POST')
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+class SlurmRESTServer(ThreadingHTTPServer):
+    daemon_threads = True
+    def __init__(self, token):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.token = token
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.lastid = 100
+        self.requests = []
+        self.connections = 0
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+    def __enter__(self):
+        self.thread.start()
+        return self
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
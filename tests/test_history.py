@@ -0,0 +1,63 @@
+from clusterq.utils import AttrDict
+from clusterq.history import database, predict, findresult
+
+def setup(state, tmp_path):
+    state.config.historydb = str(tmp_path/'history.db')
+    state.config.progname = 'g16'
+    state.config.completed_states = ['COMPLETED']
+    state.config.autosize = dict(minjobs=3, margin=1, minwalltime=60)
+    state.names.cluster = 'test'
+    state.settings.version = '16'
+    state.options.common = AttrDict(nproc=4)
+    state.status.harvested = True
+
+def addjob(jobid, **columns):
+    columns = dict(dict(cluster='test', jobid=jobid, program='g16', version='16', nproc=4, inputsize=1000, submitted=float(jobid)), **columns)
+    with database() as db:
+        db.execute(f"insert into jobs ({', '.join(columns)}) values ({', '.join('?'*len(columns))})", list(columns.values()))
+
+def test_predict_uses_accounting(state, tmp_path):
+# Jobs with the elapsed time harvested from the accounting but no stats
+# are used, and jobs without any duration are skipped
+    setup(state, tmp_path)
+    addjob('1', exitcode=0, state='COMPLETED', elapsed=3600, maxrss=1024*1024)
+    addjob('2', exitcode=0, started=0, finished=1800, maxrss=512*1024)
+    addjob('3', exitcode=0, state='COMPLETED', elapsed=600)
+    addjob('4', exitcode=0, state='COMPLETED', maxrss=4096*1024)
+    assert predict(1000, None) == (3600, 1024)
+
+def test_predict_skips_unfinished(state, tmp_path):
+# Jobs killed or still running do not size new jobs even when their exit
+# code was recorded as 0
+    setup(state, tmp_path)
+    for jobid in '123':
+        addjob(jobid, exitcode=0, state='COMPLETED', elapsed=600)
+    addjob('4', exitcode=0, state='OUT_OF_MEMORY', elapsed=36000, maxrss=8192*1024)
+    addjob('5', exitcode=0, state='RUNNING', elapsed=36000)
+    addjob('6', exitcode=0, elapsed=36000)
+    assert predict(1000, None) == (600, None)
+
+def test_predict_needs_history(state, tmp_path):
+    setup(state, tmp_path)
+    addjob('1', exitcode=0, state='COMPLETED', elapsed=3600)
+    addjob('2', exitcode=0, state='COMPLETED')
+    addjob('3', exitcode=1, state='FAILED', elapsed=60)
+    assert predict(1000, None) == (None, None)
+
+def test_predict_scales_up(state, tmp_path):
+    setup(state, tmp_path)
+    for jobid in '123':
+        addjob(jobid, exitcode=0, state='COMPLETED', elapsed=600, nproc=8, maxrss=1024*1024)
+    assert predict(2000, None) == (2400, 2048)
+
+def test_findresult_skips_killed_jobs(state, tmp_path):
+# The outputs of a job killed after writing them are not reused even when
+# its exit code was recorded as 0
+    setup(state, tmp_path)
+    state.config.outputfiles = ['log']
+    for jobid, jobstate in [('1', 'COMPLETED'), ('2', 'OUT_OF_MEMORY')]:
+        outdir = tmp_path/jobid
+        outdir.mkdir()
+        (outdir/'h2o.log').touch()
+        addjob(jobid, exitcode=0, state=jobstate, fingerprint='abc', outdir=str(outdir), jobname='h2o', finished=float(jobid))
+    assert findresult('abc') == (str(tmp_path/'1'), 'h2o')
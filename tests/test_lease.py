@@ -0,0 +1,92 @@
+import os
+import time
+import socket
+import multiprocessing
+from subprocess import Popen
+from clusterq.fileutils import AbsPath
+from clusterq.lease import acquire, release, readlock
+
+def writelock(jobdir, host, pid, stamp):
+    with open(jobdir/'lock', 'w') as f:
+        f.write(f'{host} {pid} {stamp}')
+
+def contend(jobdir, barrier, results):
+    barrier.wait()
+    owner = acquire(jobdir)
+    results.put(owner is None)
+    # Hold the claim until every process tried
+    barrier.wait()
+    if owner is None:
+        release(jobdir)
+
+def race(jobdir, count):
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(count)
+    results = context.Queue()
+    processes = [context.Process(target=contend, args=(jobdir, barrier, results)) for i in range(count)]
+    for process in processes:
+        process.start()
+    outcomes = [results.get(timeout=30) for i in range(count)]
+    for process in processes:
+        process.join()
+    return outcomes
+
+def deadpid():
+    process = Popen(['true'])
+    process.wait()
+    return process.pid
+
+def test_claim_and_release(tmp_path):
+    jobdir = AbsPath(str(tmp_path))
+    assert acquire(jobdir) is None
+    host, pid, stamp = readlock(jobdir/'lock')
+    assert (host, pid) == (socket.gethostname(), os.getpid())
+    assert acquire(jobdir) == f'{os.getpid()}@{host}'
+    release(jobdir)
+    assert not os.path.exists(jobdir/'lock')
+
+def test_concurrent_claims(tmp_path):
+    jobdir = AbsPath(str(tmp_path))
+    assert race(jobdir, 8).count(True) == 1
+    assert not os.path.exists(jobdir/'lock')
+
+def test_concurrent_recovery(tmp_path):
+# Only one of the processes that find a stale lock takes it over
+    jobdir = AbsPath(str(tmp_path))
+    writelock(jobdir, socket.gethostname(), deadpid(), time.time())
+    assert race(jobdir, 8).count(True) == 1
+
+def test_live_holder(tmp_path):
+    jobdir = AbsPath(str(tmp_path))
+    writelock(jobdir, socket.gethostname(), os.getppid(), time.time())
+    assert acquire(jobdir) == f'{os.getppid()}@{socket.gethostname()}'
+    writelock(jobdir, 'otherhost', 1, time.time())
+    assert acquire(jobdir) == '1@otherhost'
+
+def test_stale_holders(tmp_path):
+    jobdir = AbsPath(str(tmp_path))
+    # Dead process on this host
+    writelock(jobdir, socket.gethostname(), deadpid(), time.time())
+    assert acquire(jobdir) is None
+    release(jobdir)
+    # Expired lease on another host
+    writelock(jobdir, 'otherhost', 1, time.time() - 3600)
+    assert acquire(jobdir) is None
+    release(jobdir)
+    # Expired lease of a pid that is alive but was reused
+    writelock(jobdir, socket.gethostname(), os.getppid(), time.time() - 3600)
+    assert acquire(jobdir) is None
+    release(jobdir)
+    # Lock left by an earlier process with the same pid
+    writelock(jobdir, socket.gethostname(), os.getpid(), time.time())
+    assert acquire(jobdir) is None
+    release(jobdir)
+    assert not os.path.exists(jobdir/'lock')
+
+def test_release_keeps_other_claims(tmp_path):
+# A holder whose lease was recovered does not remove the new claim
+    jobdir = AbsPath(str(tmp_path))
+    assert acquire(jobdir) is None
+    writelock(jobdir, 'otherhost', 1, time.time())
+    release(jobdir)
+    assert readlock(jobdir/'lock')[:2] == ('otherhost', 1)
@@ -0,0 +1,75 @@
+import os
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from clusterq.localqueue import LocalBackend
+from conftest import rootdir
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+# The runners import clusterq from the source tree
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join(filter(None, [rootdir, os.environ.get('PYTHONPATH')])))
+    monkeypatch.chdir(tmp_path)
+    return LocalBackend(str(tmp_path/'queue'), 2)
+
+def writescript(path, body, nproc=1, dependency=None):
+    lines = ['#!/bin/bash', f"#LOCAL -n '{nproc}'", f"#LOCAL -o '{path}.out'"]
+    if dependency:
+        lines.append(f"#LOCAL -d '{dependency}'")
+    path.write_text('\n'.join(lines + [body]) + '\n')
+    return path
+
+def wait(backend, jobids, timeout=60):
+    deadline = time.time() + timeout
+    while any(backend.status(jobid) in ('PENDING', 'RUNNING') for jobid in jobids):
+        assert time.time() < deadline
+        time.sleep(0.2)
+    return [backend.status(jobid) for jobid in jobids]
+
+def test_slots_are_not_exceeded(backend, tmp_path):
+    log = tmp_path/'log'
+    body = f'echo "$(date +%s.%N) $CLUSTERQ_NPROC" >> "{log}"; sleep 1; echo "$(date +%s.%N) -$CLUSTERQ_NPROC" >> "{log}"'
+    jobids = [backend.submit(writescript(tmp_path/f'job{i}', body)) for i in range(5)]
+    jobids.append(backend.submit(writescript(tmp_path/'wide', body, nproc=2)))
+    assert wait(backend, jobids) == ['COMPLETED']*6
+    # Replay the start and end of the jobs to find the peak of cores in use
+    events = sorted((float(stamp), int(cores)) for stamp, cores in (line.split() for line in log.read_text().splitlines()))
+    inuse = peak = 0
+    for stamp, cores in events:
+        inuse += cores
+        peak = max(peak, inuse)
+    assert len(events) == 12
+    assert peak == 2
+
+def test_exit_status(backend, tmp_path):
+    jobids = [backend.submit(writescript(tmp_path/'ok', 'true')), backend.submit(writescript(tmp_path/'bad', 'exit 3'))]
+    assert wait(backend, jobids) == ['COMPLETED', 'FAILED']
+
+def test_dependencies(backend, tmp_path):
+    log = tmp_path/'log'
+    first = backend.submit(writescript(tmp_path/'first', f'sleep 1; echo first >> "{log}"'))
+    second = backend.submit(writescript(tmp_path/'second', f'echo second >> "{log}"', dependency=first))
+    failed = backend.submit(writescript(tmp_path/'failed', 'exit 1'))
+    skipped = backend.submit(writescript(tmp_path/'skipped', f'echo skipped >> "{log}"', dependency=failed))
+    assert wait(backend, [first, second, failed, skipped]) == ['COMPLETED', 'COMPLETED', 'FAILED', 'CANCELLED']
+    assert log.read_text().split() == ['first', 'second']
+
+def test_cancel(backend, tmp_path):
+    mark = tmp_path/'mark'
+    jobid = backend.submit(writescript(tmp_path/'long', f'sleep 30; touch "{mark}"'))
+    while backend.status(jobid) != 'RUNNING':
+        time.sleep(0.1)
+    backend.cancel(jobid)
+    assert wait(backend, [jobid], timeout=10) == ['CANCELLED']
+    with pytest.raises(RuntimeError):
+        backend.cancel(jobid)
+    assert not mark.exists()
+
+def test_too_many_cores(backend, tmp_path):
+    with pytest.raises(RuntimeError):
+        backend.submit(writescript(tmp_path/'huge', 'true', nproc=3))
+
+def test_unique_jobids(backend):
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        jobids = list(executor.map(lambda i: backend.newjobid(), range(64)))
+    assert sorted(jobids, key=int) == [str(i) for i in range(1, 65)]
@@ -0,0 +1,52 @@
+import os
+import time
+from subprocess import run
+from clusterq.pilot import pilotloop, queuedirs
+
+def runpilot(queue, slots, leasetimeout, renewinterval):
+    variables = dict(queue=queue, slots=slots, jobid=7, leasetimeout=leasetimeout, renewinterval=renewinterval,
+        idletimeout=2, pollinterval=1, nproc=slots, totram=1024, totproc=slots)
+    header = ''.join(f'{key}="{value}"\n' for key, value in variables.items())
+    return run(['bash', '-c', 'shopt -s extglob nullglob\n' + header + pilotloop], timeout=60)
+
+def maketask(queue, name, log, seconds, age=0):
+    path = queue/'pending'/name
+    path.write_text(f'echo {name} >> "{log}"\nsleep {seconds}\n')
+    os.utime(path, (time.time() - age,)*2)
+
+def test_old_task_runs_once(tmp_path):
+# A task that waited in pending longer than the lease timeout must not be
+# requeued by another worker as soon as it is claimed
+    queue = tmp_path/'queue'
+    for subdir in queuedirs:
+        (queue/subdir).mkdir(parents=True)
+    log = tmp_path/'log'
+    maketask(queue, 'old', log, 4, age=3600)
+    runpilot(queue, slots=2, leasetimeout=5, renewinterval=3)
+    assert log.read_text().split() == ['old']
+    assert os.listdir(queue/'done') == ['old']
+    assert not os.listdir(queue/'running')
+
+def test_tasks_are_claimed_once(tmp_path):
+    queue = tmp_path/'queue'
+    for subdir in queuedirs:
+        (queue/subdir).mkdir(parents=True)
+    log = tmp_path/'log'
+    names = [f'task{i}' for i in range(8)]
+    for name in names:
+        maketask(queue, name, log, 0)
+    runpilot(queue, slots=4, leasetimeout=5, renewinterval=1)
+    assert sorted(log.read_text().split()) == names
+    assert sorted(os.listdir(queue/'done')) == names
+
+def test_lost_lease_is_not_completed(tmp_path):
+# The worker whose lease was moved away leaves the task to its new claimant
+    queue = tmp_path/'queue'
+    for subdir in queuedirs:
+        (queue/subdir).mkdir(parents=True)
+    log = tmp_path/'log'
+    (queue/'pending'/'lost').write_text(f'mv "$lease" "{queue}/tmp/lost"\necho lost >> "{log}"\n')
+    runpilot(queue, slots=1, leasetimeout=5, renewinterval=1)
+    assert log.read_text().split() == ['lost']
+    assert not os.listdir(queue/'done')
+    assert os.listdir(queue/'tmp') == ['lost']
@@ -0,0 +1,43 @@
+import os
+from clusterq.utils import readspec
+from clusterq.history import database
+from clusterq.report import harvestaccounting
+from conftest import rootdir
+
+sacct = '''101|COMPLETED|00:10:00|00:35:00||0:0
+101.batch|COMPLETED|00:10:00|00:35:00|1500000K|0:0
+102|OUT_OF_MEMORY|01:00:00|1-00:00:00||0:125
+102.batch|OUT_OF_MEMORY|01:00:00|1-00:00:00|2.5G|0:125
+103|RUNNING|00:01:00|00:00:00||0:0
+105|TIMEOUT|02:00:00|02:00:00||0:15
+'''
+
+def setup(state, tmp_path):
+    spec = readspec(os.path.join(rootdir, 'clusterq', 'queuespecs', 'slurm.json5'))
+    (tmp_path/'sacct.out').write_text(sacct)
+    state.config.update(spec)
+    state.config.acctcmd = ['sh', '-c', f'echo "$1" > "{tmp_path}/jobids"; cat "{tmp_path}/sacct.out"', 'sacct']
+    state.config.historydb = str(tmp_path/'history.db')
+    state.names.cluster = 'test'
+
+def test_harvest(state, tmp_path):
+    setup(state, tmp_path)
+    with database() as db:
+        for jobid in ('101', '102', '103', '104'):
+            db.execute("insert into jobs (cluster, jobid, submitted) values ('test', ?, 0)", (jobid,))
+        db.execute("insert into jobs (cluster, jobid, submitted, state) values ('test', '100', 0, 'COMPLETED')")
+        # Exit status written by the stage-out trap
+        db.execute("insert into jobs (cluster, jobid, submitted, exitcode) values ('test', '105', 0, 143)")
+    assert harvestaccounting() == 4
+    # Jobs in a final state are not queried again
+    assert (tmp_path/'jobids').read_text().split() == ['101,102,103,104,105']
+    rows = database().execute('select jobid, state, exitcode, elapsed, cputime, maxrss from jobs where jobid != ? order by jobid', ('100',)).fetchall()
+    assert rows == [
+        ('101', 'COMPLETED', 0, 600.0, 2100.0, 1500000),
+        ('102', 'OUT_OF_MEMORY', 253, 3600.0, 86400.0, 2621440),
+        ('103', 'RUNNING', None, 60.0, 0.0, None),
+        ('104', None, None, None, None, None),
+        ('105', 'TIMEOUT', 143, 7200.0, 7200.0, None),
+    ]
+    harvestaccounting()
+    assert (tmp_path/'jobids').read_text().split() == ['103,104']
@@ -0,0 +1,86 @@
+import pytest
+from clusterq.queue import SlurmRESTBackend
+from slurmrestd import SlurmRESTServer
+
+jobscript = '''#!/bin/bash
+#SBATCH -J water
+#SBATCH --ntasks=4
+#SBATCH -t 1:00:00
+#SBATCH --mem 2G
+#SBATCH --signal=B:USR1@300
+g16 water.gjf
+#SBATCH -p ignored
+'''
+
+@pytest.fixture
+def server():
+    with SlurmRESTServer('secret') as server:
+        yield server
+
+@pytest.fixture
+def script(tmp_path):
+    path = tmp_path/'script'
+    path.write_text(jobscript)
+    return path
+
+def test_submit(server, script):
+    backend = SlurmRESTBackend(server.url, 'v0.0.39', 'secret', 5)
+    assert backend.submit(script) == '101'
+    method, path, token, body = server.requests[-1]
+    assert (method, path, token) == ('POST', '/slurm/v0.0.39/job/submit', 'secret')
+    assert body['script'] == jobscript
+    job = body['job']
+    assert (job['name'], job['tasks'], job['time_limit'], job['memory_per_node']) == ('water', 4, 60, 2048)
+    assert (job['kill_warning_signal'], job['kill_warning_delay'], job['kill_warning_flags']) == ('USR1', 300, ['BATCH_JOB'])
+    assert 'partition' not in job
+
+def test_status(server, script):
+    backend = SlurmRESTBackend(server.url, 'v0.0.39', 'secret', 5)
+    jobid = backend.submit(script)
+    assert backend.status(jobid) == 'PENDING'
+    assert backend.status('999') is None
+    # The snapshot is reused within the cache time
+    count = len(server.requests)
+    assert backend.status(jobid) == 'PENDING'
+    assert len(server.requests) == count
+
+def test_status_after_snapshot(server, script):
+# A job submitted by another client after the snapshot was taken must not
+# be reported as finished
+    backend = SlurmRESTBackend(server.url, 'v0.0.39', 'secret', 60)
+    first = backend.submit(script)
+    assert backend.status(first) == 'PENDING'
+    second = SlurmRESTBackend(server.url, 'v0.0.39', 'secret', 60).submit(script)
+    assert backend.status(second) == 'PENDING'
+    assert server.requests[-1][:2] == ('GET', f'/slurm/v0.0.39/job/{second}')
+
+def test_cancel(server, script):
+    backend = SlurmRESTBackend(server.url, 'v0.0.39', 'secret', 60)
+    jobid = backend.submit(script)
+    assert backend.status(jobid) == 'PENDING'
+    backend.cancel(jobid)
+    assert server.requests[-1][:2] == ('DELETE', f'/slurm/v0.0.39/job/{jobid}')
+    assert backend.status(jobid) == 'CANCELLED'
+
+def test_keepalive(server, script):
+    backend = SlurmRESTBackend(server.url, 'v0.0.39', 'secret', 0)
+    jobids = [backend.submit(script) for i in range(5)]
+    for jobid in jobids:
+        backend.status(jobid)
+    backend.cancel(jobids[0])
+    assert len(server.requests) == 11
+    assert server.connections == 1
+
+def test_reconnect(server, script):
+# The connection is opened again when the server closed it
+    backend = SlurmRESTBackend(server.url, 'v0.0.39', 'secret', 0)
+    backend.submit(script)
+    backend.connection.sock.close()
+    backend.connection.sock = None
+    assert backend.submit(script) == '102'
+    assert server.connections == 2
+
+def test_error(server, script):
+    backend = SlurmRESTBackend(server.url, 'v0.0.39', 'wrong', 5)
+    with pytest.raises(RuntimeError, match='Authentication failure'):
+        backend.submit(script)
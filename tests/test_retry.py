@@ -0,0 +1,30 @@
+from argparse import ArgumentParser
+from clusterq.retry import replayargs, dropoption
+
+def makeparser():
+    parser = ArgumentParser()
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('-n', '--nproc', type=int)
+    parser.add_argument('-o', '--out')
+    parser.add_argument('-r', '--restart', action='append')
+    parser.add_argument('--walltime')
+    parser.add_argument('--raw', action='store_true')
+    parser.add_argument('--yes', action='store_true')
+    parser.add_argument('--retry-of')
+    return parser
+
+def test_replay_drops_files_by_position():
+# An option value equal to an input file is kept
+    argv = ['h2o.gjf', '-o', 'h2o.gjf', '--raw', 'c6h6.gjf', '-r', 'h2o.gjf']
+    assert replayargs(makeparser(), argv) == ['-o', 'h2o.gjf', '--raw', '-r', 'h2o.gjf']
+
+def test_replay_option_forms():
+    argv = ['-n4', '--out=dir', '--wall', '30', 'h2o.gjf', '--', '-h2o.gjf']
+    assert replayargs(makeparser(), argv) == ['-n4', '--out=dir', '--wall', '30']
+
+def test_replay_drops_interactive_options():
+    argv = ['--yes', '--retry-of', '12', '--retry-of=13', '-n', '2', 'h2o.gjf']
+    assert replayargs(makeparser(), argv) == ['-n', '2']
+
+def test_dropoption():
+    assert dropoption(['-r', 'a', '--restart=b', '--restart', 'c', '-n', '2'], '-r', '--restart') == ['-n', '2']
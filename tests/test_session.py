@@ -0,0 +1,83 @@
+import os
+import time
+import shutil
+import pytest
+from threading import Thread
+from clusterq.session import Session
+from conftest import rootdir
+
+fakeg16 = '''#!/bin/bash
+echo "$1 nproc=$nproc" > job.log
+echo chk > job.chk
+'''
+
+def makecfgdir(path, clustername, queuespec, **settings):
+    (path/'profiles').mkdir(parents=True)
+    for subdir in ('progspecs', 'queuespecs'):
+        os.symlink(os.path.join(rootdir, 'clusterq', subdir), path/subdir)
+    cluster = dict(clustername=clustername, queuespecfile=queuespec, filesync='local', delay='0',
+        logdir=str(path/'logs'), historydb=str(path/'history.db'), defaults=dict(scratch=str(path/'scratch')), **settings)
+    (path/'profiles'/'__cluster__.json5').write_text(repr(cluster))
+    (path/'profiles'/'g16.json5').write_text(repr(dict(progname='g16', displayname='Gaussian 16', progspecfile='gaussian.json5',
+        versions={'A.03': dict(executable=str(path.parent/'bin'/'g16'))}, defaults=dict(version='A.03'))))
+    return str(path)
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join(filter(None, [rootdir, os.environ.get('PYTHONPATH')])))
+    (tmp_path/'bin').mkdir()
+    (tmp_path/'bin'/'g16').write_text(fakeg16)
+    (tmp_path/'bin'/'g16').chmod(0o755)
+    workdir = tmp_path/'work'
+    workdir.mkdir()
+    for name in ('h2o', 'opt', 'vib'):
+        shutil.copy(os.path.join(rootdir, 'tests', 'gaussian', f'{name}.gjf'), workdir)
+    return workdir
+
+def test_concurrent_sessions(tmp_path, workdir):
+# Sessions with different clusters in different threads do not share
+# configuration, scripts or traces
+    sessions = {}
+    for name, queuespec in (('slurm', 'slurm.json5'), ('local', 'local.json5')):
+        shutil.copytree(workdir, tmp_path/name)
+        sessions[name] = Session('g16', makecfgdir(tmp_path/'cfg'/name, name, queuespec), cwd=tmp_path/name, yes=True)
+    results = {}
+    def stage(name):
+        results[name] = [result for jobname in ('h2o', 'opt', 'vib') for result in sessions[name].stage([f'{jobname}.gjf'])]
+    threads = [Thread(target=stage, args=(name,)) for name in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for name, header, other in (('slurm', '#SBATCH', '#LOCAL'), ('local', '#LOCAL', '#SBATCH')):
+        assert [result.outdir for result in results[name]] == [str(tmp_path/name/jobname) for jobname in ('h2o', 'opt', 'vib')]
+        for result in results[name]:
+            with open(result.outdir/'.job'/'script', 'r') as f:
+                script = f.read()
+            assert header in script and other not in script
+        # Spans are summarized per session and not buffered for a tracer
+        assert sessions[name].state.tracing.summary['job'][0] == 3
+        assert sessions[name].state.tracing.pending == []
+
+def test_submit_and_status(tmp_path, workdir):
+    session = Session('g16', makecfgdir(tmp_path/'local', 'workstation', 'local.json5', localslots=2), cwd=workdir, yes=True)
+    results = session.submit_many(['h2o.gjf', 'opt.gjf'])
+    assert [result.jobname for result in results] == ['h2o', 'opt']
+    deadline = time.time() + 60
+    while any(state in ('PENDING', 'RUNNING') for state in session.status(results).values()):
+        assert time.time() < deadline
+        time.sleep(0.2)
+    assert set(session.status(results).values()) == {'COMPLETED'}
+    for result in results:
+        assert os.path.isfile(result.outdir/f'{result.jobname}.log')
+
+def test_errors(tmp_path, workdir):
+# Failed jobs are skipped and fatal errors are raised instead of exiting
+    cfgdir = makecfgdir(tmp_path/'local', 'workstation', 'local.json5')
+    session = Session('g16', cfgdir, cwd=workdir, yes=True)
+    assert session.stage(['missing.gjf']) == []
+    assert len(session.stage(['h2o.gjf'])) == 1
+    session = Session('g16', cfgdir, cwd=workdir, yes=True, version='Z.99')
+    with pytest.raises(RuntimeError):
+        session.stage(['h2o.gjf'])